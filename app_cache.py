@@ -0,0 +1,213 @@
+# app_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+def _identity(value):
+    return value
+
+
+class AppCache:
+    """
+    Two-tier cache: an in-process LRU bounded in bytes with a TTL, and an
+    optional MongoDB collection shared by every worker process.
+
+    Keys are tuples; values are anything the encoder turns into something
+    both tiers can store (str/dict for the MongoDB tier).
+    """
+
+    def __init__(self, name, max_bytes, ttl_seconds, collection=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection  # Optional Motor collection (second tier)
+
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.current_bytes = 0
+        self.inflight = {}
+        self.ttl_index_ready = False
+
+        self.hits = 0
+        self.misses = 0
+        self.mongo_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_to_str(key):
+        return "|".join("" if part is None else str(part) for part in key)
+
+    def get(self, key):
+        """Return the in-memory value for key, or None on a miss."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, size, expires_at=None):
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        if expires_at is None:
+            expires_at = time.time() + self.ttl_seconds
+        self.entries[key] = (expires_at, size, value)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes and self.entries:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+    async def _ensure_ttl_index(self):
+        if self.ttl_index_ready:
+            return
+        await self.collection.create_index("expire_at", expireAfterSeconds=0)
+        self.ttl_index_ready = True
+
+    async def _mongo_get(self, key):
+        try:
+            doc = await self.collection.find_one({"_id": self.key_to_str(key)})
+        except Exception as e:
+            print(f"[AppCache:{self.name}] MongoDB read error: {e}")
+            return None
+        if not doc:
+            return None
+        expire_at = doc["expire_at"].replace(tzinfo=timezone.utc).timestamp()
+        if expire_at <= time.time():
+            return None
+        return doc["value"], expire_at
+
+    async def _mongo_set(self, key, value):
+        expire_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        try:
+            await self._ensure_ttl_index()
+            await self.collection.update_one(
+                {"_id": self.key_to_str(key)},
+                {"$set": {"value": value, "expire_at": expire_at}},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"[AppCache:{self.name}] MongoDB write error: {e}")
+
+    async def _promote_from_mongo(self, key, sizeof):
+        """Copy a MongoDB entry into memory and return its stored value, or None."""
+        mongo_entry = await self._mongo_get(key)
+        if mongo_entry is None:
+            return None
+        stored, expires_at = mongo_entry
+        self.mongo_hits += 1
+        self.set(key, stored, sizeof(stored), expires_at)
+        return stored
+
+    async def lookup(self, key, sizeof=len):
+        """Return the stored value for key from either tier, or None on a miss."""
+        stored = self.get(key)
+        if stored is not None:
+            self.hits += 1
+            return stored
+        if self.collection is not None:
+            stored = await self._promote_from_mongo(key, sizeof)
+            if stored is not None:
+                return stored
+        self.misses += 1
+        return None
+
+    async def store(self, key, stored, sizeof=len):
+        """Store an already encoded value in both tiers."""
+        self.set(key, stored, sizeof(stored))
+        if self.collection is not None:
+            await self._mongo_set(key, stored)
+
+    async def increment(self, key, fields):
+        """Increment numeric fields of an entry, in memory and in MongoDB."""
+        entry = self.entries.get(key)
+        if entry is not None and isinstance(entry[2], dict):
+            for field, amount in fields.items():
+                entry[2][field] = entry[2].get(field, 0) + amount
+        if self.collection is not None:
+            try:
+                await self.collection.update_one(
+                    {"_id": self.key_to_str(key)},
+                    {"$inc": {f"value.{field}": amount for field, amount in fields.items()}},
+                )
+            except Exception as e:
+                print(f"[AppCache:{self.name}] MongoDB write error: {e}")
+
+    async def get_or_load(
+        self,
+        key,
+        loader,
+        should_cache=lambda value: value is not None,
+        encode=_identity,
+        decode=_identity,
+        sizeof=len,
+    ):
+        """
+        Return the cached value for key, or await loader() and cache its result.
+
+        Concurrent misses on the same key share a single loader call. The load
+        runs in its own task, so cancelling the caller that started it does
+        not cancel it for the other callers waiting on the key.
+
+        Args:
+            key: Tuple identifying the resource.
+            loader: Coroutine function producing the value on a miss.
+            should_cache: Predicate deciding whether a loaded value is cached.
+            encode/decode: Convert between the loaded value and the stored value.
+            sizeof: Size in bytes of a stored value, for the memory bound.
+        """
+        stored = self.get(key)
+        if stored is not None:
+            self.hits += 1
+            return decode(stored)
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            task = asyncio.create_task(self._load(key, loader, should_cache, encode, decode, sizeof))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._load_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, should_cache, encode, decode, sizeof):
+        if self.collection is not None:
+            stored = await self._promote_from_mongo(key, sizeof)
+            if stored is not None:
+                return decode(stored)
+
+        self.misses += 1
+        value = await loader()
+        if should_cache(value):
+            await self.store(key, encode(value), sizeof)
+        return value
+
+    def _load_done(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when every caller was cancelled
+
+    def stats(self):
+        lookups = self.hits + self.mongo_hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.mongo_hits) / lookups, 4) if lookups else 0.0,
+        }
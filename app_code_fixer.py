@@ -1,13 +1,173 @@
 import ast
-import json
-import pandas as pd
+import asyncio
+import re
+from collections import Counter
 from typing import Dict, Any, List, Optional
 
 from app_imaging import AppImaging
-from app_llm import AppLLM
+from app_llm import AppLLM, bypass_response_cache
 from app_logger import AppLogger
 from app_mongo import AppMongoDb
-from utils import generate_unique_alphanumeric, get_timestamp, replace_lines
+from app_records import ExceptionLink, FixContext, ImpactRecord, group_exceptions
+from app_validators import AppSyntaxValidator
+from config import Config
+from utils import (
+    generate_unique_alphanumeric,
+    get_timestamp,
+    merge_ranges,
+    replace_lines,
+    replaced_ranges,
+)
+
+# JSON response templates. Kept verbatim: they are part of the prompts and of the
+# response cache keys, and their keys drive JSON validation.
+JSON_RESP = """
+            {
+            "updated":"<YES/NO to state if you updated the code or not (if you believe it did not need fixing)>",
+            "comment":"<explain here what you updated (or the reason why you did not update it)>",
+            "missing_information":"<list here information needed to finalize the code (or NA if nothing is needed or if the code was not updated)>",
+            "signature_impact":"<YES/NO/UNKNOWN, to state here if the signature of the code will be updated as a consequence of changed parameter list, types, return type, etc.>",
+            "exception_impact":"<YES/NO/UNKNOWN, to state here if the exception handling related to the code will be update, as a consequence of changed exception thrown or caught, etc.>",
+            "enclosed_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact code enclosed in it in the same source file, such as methods defined in updated class, etc.>",
+            "other_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact any other code referencing this code>",
+            "impact_comment":"<comment here on signature, exception, enclosed, other impacts on any other code calling this one (or NA if not applicable)>",
+            "code":"<the fixed code goes here (or original code if the code was not updated)>"
+            }
+            """
+
+JSON_DEP_RESP = """
+            {
+            "updated":"<YES/NO to state if you updated the dependent code or not (if you believe it did not need updating)>",
+            "comment":"<explain here what you updated (or NA if the dependent code does not need to be updated)>",
+            "missing_information":"<list here information needed to finalize the dependent code (or NA if nothing is needed or if the dependent code was not updated)>",
+            "signature_impact":"<YES/NO/UNKNOWN, to state here if the signature of the dependent code will be updated as a consequence of changed parameter list, types, return type, etc.>",
+            "exception_impact":"<YES/NO/UNKNOWN, to state here if the exception handling related to the dependent code will be update, as a consequence of changed exception thrown or caugth, etc.>",
+            "enclosed_impact":"<YES/NO/UNKNOWN, to state here if the dependent code update could impact further code enclosed in it in the same source file, such as methods defined in updated class, etc.>",
+            "other_impact":"<YES/NO/UNKNOWN, to state here if the dependent code update could impact any other code referencing this code>",
+            "impact_comment":"<comment here on signature, exception, enclosed, other impacts on any other code calling this one (or NA if not applicable)>",
+            "code":"<the updated dependent code goes here (or original dependent code if the dependent code was not updated)>"
+            }"""
+
+JSON_FULLFILE_RESP = """
+            {
+            "updated":"<YES/NO to state if you updated the code or not (if you believe it did not need fixing)>",
+            "comment":"<explain here what you updated (or the reason why you did not update it)>",
+            "code":"<the fixed code goes here (or original code if the code was not updated)>"
+            }
+            """
+
+JSON_BATCH_RESP = """
+            [
+            {
+            "objectid":"<the object id exactly as given>",
+            "updated":"<YES/NO to state if you updated the code or not (if you believe it did not need fixing)>",
+            "comment":"<explain here what you updated (or the reason why you did not update it)>",
+            "missing_information":"<list here information needed to finalize the code (or NA if nothing is needed or if the code was not updated)>",
+            "signature_impact":"<YES/NO/UNKNOWN, to state here if the signature of the code will be updated as a consequence of changed parameter list, types, return type, etc.>",
+            "exception_impact":"<YES/NO/UNKNOWN, to state here if the exception handling related to the code will be update, as a consequence of changed exception thrown or caught, etc.>",
+            "enclosed_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact code enclosed in it in the same source file, such as methods defined in updated class, etc.>",
+            "other_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact any other code referencing this code>",
+            "impact_comment":"<comment here on signature, exception, enclosed, other impacts on any other code calling this one (or NA if not applicable)>",
+            "code":"<the fixed code goes here (or original code if the code was not updated)>"
+            }
+            ]
+            """
+
+JSON_HUNKS_RESP = """
+            [
+            {
+            "id":"<the region id exactly as given (HEADER or a number)>",
+            "code":"<the complete code of the region, fixed if needed (or the original region code if it was not updated)>"
+            }
+            ]
+            """
+
+# Static prompt fragments; their token counts are precomputed once
+FIX_PROMPT_TASK = (
+    "\n\n\nTASK:\n1/ Generate a version without the pattern occurrence(s) of the following code, "
+    "'''\n"
+)
+FIX_PROMPT_GUIDELINES = (
+    "\n'''\n"
+    "2/ Provide an analysis of the transformation: detail what you did in the 'comment' field, forecast "
+    "impacts on code signature, exception management, enclosed objects or other areas in the "
+    "'signature_impact', 'exception_impact', 'enclosed_impact, and 'other_impact' fields respectively, "
+    "with some comments on your prognostics in the 'impact_comment' field.\n"
+    "\nGUIDELINES:\nUse the following JSON structure to respond:\n'''\n"
+)
+IMPACT_CONTEXT_HEADER = "\nIMPACT ANALYSIS CONTEXT:\n"
+BATCH_PROMPT_TASK = (
+    "\n\n\nTASK:\n1/ For each of the following objects, generate a version without the pattern "
+    "occurrence(s) of its code.\n"
+)
+BATCH_PROMPT_GUIDELINES = (
+    "\n2/ For each object, provide an analysis of the transformation: detail what you did in the 'comment' "
+    "field, forecast impacts on code signature, exception management, enclosed objects or other areas in the "
+    "'signature_impact', 'exception_impact', 'enclosed_impact, and 'other_impact' fields respectively, "
+    "with some comments on your prognostics in the 'impact_comment' field.\n"
+    "\nGUIDELINES:\nUse the following JSON structure to respond, with one element per object:\n'''\n"
+)
+DEP_PROMPT_CONTEXT = " is dependent on code that was modified by an AI: \n"
+DEP_PROMPT_TASK = " \nTASK:\nCheck and update if needed the following code: \n'''\n"
+DEP_PROMPT_GUIDELINES = "\n'''GUIDELINES: \nUse the following JSON structure to respond: \n'''\n"
+FULLFILE_PROMPT_TASK = (
+    "TASK:\n"
+    "1) fix syntax errors.\n"
+    "2) add only missing packages.\n"
+    "3) add single line comments saying that this is fixed by Gen AI for the lines only fixed by Gen AI.\n"
+    "4) do not remove already existing comments.\n"
+    "5) indent the code properly.\n"
+    "'''\n"
+)
+FULLFILE_PROMPT_GUIDELINES = "\n'''\nGUIDELINES:\nUse the following JSON structure to respond:\n'''\n"
+HUNKS_PROMPT_TASK = (
+    "TASK:\n"
+    "The regions below are excerpts of one source file in which some code was replaced by an AI fix.\n"
+    "1) fix syntax errors.\n"
+    "2) add only missing packages, in the HEADER region.\n"
+    "3) add single line comments saying that this is fixed by Gen AI for the lines only fixed by Gen AI.\n"
+    "4) do not remove already existing comments.\n"
+    "5) indent the code properly.\n"
+    "Return every region complete, even when unchanged. Do not add, merge or split regions.\n"
+)
+HUNKS_PROMPT_GUIDELINES = "GUIDELINES:\nUse the following JSON structure to respond:\n'''\n"
+TEMPLATE_END = "\n'''\n"
+JSON_ONLY_GUIDELINES = (
+    "\nMake sure your response is a valid JSON string.\nRespond only the JSON string, and only the JSON string. "
+    "Do not enclose the JSON string in triple quotes, backslashes, ... Do not add comments outside of the JSON structure.\n"
+)
+FULLFILE_JSON_ONLY_GUIDELINES = (
+    "Make sure your response is a valid JSON string.\nRespond only the JSON string, and only the JSON string.\n"
+    "Do not enclose the JSON string in triple quotes, backslashes, ... Do not add comments outside of the JSON structure.\n"
+)
+
+# Import/include/package lines that make up a file header, across technologies
+HEADER_LINE_RE = re.compile(
+    r"^\s*(import\b|from\s+\S+\s+import\b|using\s|#\s*include\b|package\s|require\b|@import\b|<%@)"
+)
+
+STATIC_PROMPT_PARTS = [
+    JSON_RESP,
+    JSON_DEP_RESP,
+    JSON_FULLFILE_RESP,
+    FIX_PROMPT_TASK,
+    FIX_PROMPT_GUIDELINES,
+    IMPACT_CONTEXT_HEADER,
+    DEP_PROMPT_CONTEXT,
+    DEP_PROMPT_TASK,
+    DEP_PROMPT_GUIDELINES,
+    FULLFILE_PROMPT_TASK,
+    FULLFILE_PROMPT_GUIDELINES,
+    JSON_BATCH_RESP,
+    BATCH_PROMPT_TASK,
+    BATCH_PROMPT_GUIDELINES,
+    JSON_HUNKS_RESP,
+    HUNKS_PROMPT_TASK,
+    HUNKS_PROMPT_GUIDELINES,
+    TEMPLATE_END,
+    JSON_ONLY_GUIDELINES,
+    FULLFILE_JSON_ONLY_GUIDELINES,
+]
 
 
 class AppCodeFixer:
@@ -17,12 +177,48 @@ class AppCodeFixer:
         mongo_db: AppMongoDb,
         ai_model: AppLLM,
         imaging: AppImaging,
+        config: Config,
     ):
         self.app_logger = app_logger
         self.mongo_db = mongo_db
         self.llm = ai_model
         self.imaging = imaging
-        self.first_prompt = True
+        self.max_concurrent_objects = max(1, int(config.MAX_CONCURRENT_OBJECTS))
+        self.llm.token_counter.precompute(STATIC_PROMPT_PARTS)
+
+        # "full" resends whole files for the final check, "diff" only the edited regions
+        self.fullfile_validation_mode = config.FULLFILE_VALIDATION_MODE
+        self.validation_context_lines = config.FULLFILE_VALIDATION_CONTEXT_LINES
+        self.validation_header_lines = config.FULLFILE_VALIDATION_HEADER_LINES
+        self.syntax_validator = AppSyntaxValidator(config)
+
+        # "off" fixes objects one by one; "file" and "prompt" batch objects sharing a prompt
+        # (and, for "file", a source file) into one model call
+        self.batch_mode = config.FIX_BATCH_MODE
+        self.batch_max_objects = max(1, int(config.FIX_BATCH_MAX_OBJECTS))
+        self.batch_max_code_tokens = config.FIX_BATCH_MAX_CODE_TOKENS
+        self.batch_stats = {"batches": 0, "batched_objects": 0, "fallback_objects": 0}
+
+    @staticmethod
+    def __merge_engine_output(
+        engine_output: Dict[str, Any], fragment: Dict[str, Any]
+    ) -> None:
+        """Merge the result of one object into engine_output.
+
+        Fragments are merged in request order, so the result matches what a
+        sequential run building engine_output in place would produce.
+        """
+        engine_output["objects"].extend(fragment["objects"])
+        for content in fragment["contentinfo"]:
+            for existing in engine_output["contentinfo"]:
+                if existing["filefullname"] == content["filefullname"]:
+                    existing["objects"].extend(content["objects"])
+                    existing["originalfilecontent"][1][0].update(
+                        content["originalfilecontent"][1][0]
+                    )
+                    break
+            else:
+                engine_output["contentinfo"].append(content)
 
     async def __gen_code_connected_json(
         self,
@@ -33,317 +229,45 @@ class AppCodeFixer:
         PromptContent: str,
         json_resp: str,
         engine_output: Dict[str, Any],
+        context: Optional[FixContext] = None,
     ) -> Dict[str, Any]:
         try:
             object_dictionary = {"objectid": ObjectID, "status": "", "message": ""}
-            content_info_dictionary = {
-                "filefullname": "",
-                "objects": [],
-                "originalfilecontent": "",
-            }
-
-            object_id = ObjectID
-            print(
-                "---------------------------------------------------------------------------------------------------------------------------------------"
-            )
-            print(f"\n Processing object_id -> {object_id}.....")
-
-            # Initialize DataFrames to store exceptions and impacts
-            exceptions = pd.DataFrame(columns=["link_type", "exception"])
-            impacts = pd.DataFrame(
-                columns=[
-                    "object_type",
-                    "object_signature",
-                    "object_link_type",
-                    "object_code",
-                ]
-            )
-
-            # Construct URL to fetch object details
-            object_response, object_url = await self.imaging.get_source_locations(
-                TenantName, ApplicationName, object_id
-            )
-
-            # Check if object details were fetched successfully
-            if object_response.status_code == 200:
-                object_data = object_response.json()  # Parse object data
-                object_type = object_data["typeId"]  # Get object type
-                object_signature = object_data["mangling"]  # Get object signature
-                object_technology = object_data["programmingLanguage"][
-                    "name"
-                ]  # Get programming language
-
-                if object_data["sourceLocations"] is None:
-                    object_dictionary["status"] = "failure"
-                    object_dictionary["message"] = (
-                        f"failed because of reason: sourceLocations not available for this object from Imaging API -> {object_url}"
-                    )
-                    print(object_dictionary["message"])
-                    engine_output["objects"].append(object_dictionary)
-                    return engine_output
 
-                if object_data["external"] == "true":
-                    object_dictionary["status"] = "failure"
-                    object_dictionary["message"] = (
-                        f"failed because of reason: It is an external object and it does not contains sourceLocations."
-                    )
-                    print(object_dictionary["message"])
+            # Batched objects that fall back to a call of their own are already collected
+            if context is None:
+                context = await self.__collect_fix_context(
+                    ApplicationName, TenantName, ObjectID, object_dictionary
+                )
+                if context is None:
                     engine_output["objects"].append(object_dictionary)
                     return engine_output
 
-                source_location = object_data["sourceLocations"][
-                    0
-                ]  # Extract source location
-                object_source_path = source_location["filePath"]  # Get source file path
-                object_field_id = source_location["fileId"]  # Get file ID
-                object_start_line = source_location[
-                    "startLine"
-                ]  # Get start line number
-                object_end_line = source_location["endLine"]  # Get end line number
-
-                # fetch object code
-                obj_code = await self.imaging.get_source(
-                    "object",
-                    TenantName,
-                    ApplicationName,
-                    object_field_id,
-                    object_start_line,
-                    object_end_line,
-                )
-
-                # Fetch callees for the current object
-                object_callees_response, object_callees_url = (
-                    await self.imaging.get_callees(
-                        TenantName, ApplicationName, object_id
-                    )
-                )
-
-                # Check if callees were fetched successfully
-                if object_callees_response.status_code == 200:
-                    object_exceptions = (
-                        object_callees_response.json()
-                    )  # Parse exceptions data
-                    # Process each exception for the current object
-                    for object_exception in object_exceptions:
-                        link_type = object_exception.get(
-                            "linkType", ""
-                        ).lower()  # Get link type
-                        if link_type in [
-                            "raise",
-                            "throw",
-                            "catch",
-                        ]:  # Check for relevant link types
-                            new_row = pd.DataFrame(
-                                {
-                                    "link_type": [object_exception.get("linkType", "")],
-                                    "exception": [object_exception.get("name", "")],
-                                }
-                            )
-                            exceptions = pd.concat(
-                                [exceptions, new_row], ignore_index=True
-                            )  # Append to exceptions DataFrame
-                else:
-                    print(
-                        f"Failed to fetch callees using {object_callees_url}. Status code: {object_callees_response.status_code}"
-                    )
-
-                # Fetch callers for the current object
-                object_callers_response, object_callers_url = (
-                    await self.imaging.get_callers(
-                        TenantName, ApplicationName, object_id
-                    )
-                )
-
-                # Check if callers were fetched successfully
-                if object_callers_response.status_code == 200:
-                    impact_objects = (
-                        object_callers_response.json()
-                    )  # Parse impact objects data
-                    # Process each impact object
-                    for impact_object in impact_objects:
-                        impact_object_id = impact_object.get(
-                            "id"
-                        )  # Get impact object ID
-                        impact_object_response, impact_object_url = (
-                            await self.imaging.get_source_locations(
-                                TenantName, ApplicationName, impact_object_id
-                            )
-                        )
-
-                        # Check if impact object data was fetched successfully
-                        if impact_object_response.status_code == 200:
-                            impact_object_data = (
-                                impact_object_response.json()
-                            )  # Parse impact object data
-                            impact_object_type = impact_object_data.get(
-                                "typeId", ""
-                            )  # Get impact object type
-                            impact_object_signature = impact_object_data.get(
-                                "mangling", ""
-                            )  # Get impact object signature
-                            impact_object_source_location = impact_object_data[
-                                "sourceLocations"
-                            ][
-                                0
-                            ]  # Extract source location
-                            impact_object_source_path = impact_object_source_location[
-                                "filePath"
-                            ]  # Get source file path
-                            impact_object_field_id = int(
-                                impact_object_source_location["fileId"]
-                            )  # Get file ID
-                            impact_object_start_line = int(
-                                impact_object_source_location["startLine"]
-                            )  # Get start line number
-                            impact_object_end_line = int(
-                                impact_object_source_location["endLine"]
-                            )  # Get end line number
-
-                            if impact_object_data["external"] == "true":
-                                object_dictionary["status"] = "failure"
-                                object_dictionary["message"] = (
-                                    f"failed because of reason: It is an external object and it does not contains sourceLocations."
-                                )
-                                print(object_dictionary["message"])
-                                engine_output["objects"].append(object_dictionary)
-                                return engine_output
-
-                            impact_object_full_code = await self.imaging.get_source(
-                                "impact object",
-                                TenantName,
-                                ApplicationName,
-                                impact_object_field_id,
-                                impact_object_start_line,
-                                impact_object_end_line,
-                            )
-
-                        else:
-                            impact_object_type = ""
-                            impact_object_signature = ""
-                            print(
-                                f"Failed to fetch impact object data using {impact_object_url}. Status code: {impact_object_response.status_code}"
-                            )
-
-                        impact_object_link_type = impact_object.get(
-                            "linkType", ""
-                        )  # Get link type for impact object
-
-                        # Handle bookmarks associated with the impact object
-                        bookmarks = impact_object.get("bookmarks")
-                        if not bookmarks:
-                            impact_object_bookmark_code = ""
-                        else:
-                            bookmark = bookmarks[0]
-                            impact_object_bookmark_field_id = bookmark.get(
-                                "fileId", ""
-                            )  # Get file ID from bookmark
-                            # Calculate start and end lines for impact object code
-                            impact_object_bookmark_start_line = max(
-                                int(bookmark.get("startLine", 1)) - 1, 0
-                            )
-                            impact_object_bookmark_end_line = max(
-                                int(bookmark.get("endLine", 1)) - 1, 0
-                            )
-                            impact_object_bookmark_code = await self.imaging.get_source(
-                                "impact object bookmark",
-                                TenantName,
-                                ApplicationName,
-                                impact_object_bookmark_field_id,
-                                impact_object_bookmark_start_line,
-                                impact_object_bookmark_end_line,
-                            )
-
-                        # Append the impact object data to the impacts DataFrame
-                        new_impact_row = pd.DataFrame(
-                            {
-                                "object_id": [impact_object_id],
-                                "object_type": [impact_object_type],
-                                "object_signature": [impact_object_signature],
-                                "object_link_type": [impact_object_link_type],
-                                "object_bookmark_code": [impact_object_bookmark_code],
-                                "object_source_path": [impact_object_source_path],
-                                "object_file_id": [int(impact_object_field_id)],
-                                "object_start_line": [int(impact_object_start_line)],
-                                "object_end_line": [int(impact_object_end_line)],
-                                "object_full_code": [impact_object_full_code],
-                            }
-                        )
-                        impacts = pd.concat(
-                            [impacts, new_impact_row], ignore_index=True
-                        )
-                else:
-                    print(
-                        f"Failed to fetch callers using {object_callers_url}. Status code: {object_callers_response.status_code}"
-                    )
-            else:
-                print(
-                    f"Failed to fetch object data using {object_url}. Status code: {object_response.status_code}"
-                )  # Skip to the next object if there is an error
-
-            if not exceptions.empty:
-                # Group exceptions by link type and aggregate unique exceptions
-                grouped_exceptions = exceptions.groupby("link_type")[
-                    "exception"
-                ].unique()
-
-                # Construct exception text
-                exception_text = (
-                    f"Take into account that {object_type} <{object_signature}>: "
-                    + "; ".join(
-                        [
-                            f"{link_type} {', '.join(exc)}"
-                            for link_type, exc in grouped_exceptions.items()
-                        ]
-                    )
-                )
-                # print(f"exception_text = {exception_text}")
-            else:
-                exception_text = ""  # No exceptions found
-
-            def generate_text(impacts):
-                # Generate impact analysis text from impacts DataFrame
-                base_method = f"{object_type} <{object_signature}>"
-                text = f"Take into account that {base_method} is used by:\n"
-                for i, row in impacts.iterrows():
-                    text += f" {i + 1}. {row['object_type']} <{row['object_signature']}> has a <{row['object_link_type']}> dependency as found in code:\n"
-                    text += f"````\n\t{row['object_bookmark_code']}\n````\n"
-                return text
-
-            if not impacts.empty:
-                impact_text = generate_text(impacts)  # Generate impact analysis text
-                # print(f"impact_text = {impact_text}")
-            else:
-                impact_text = ""  # No impacts found
-
-            # Construct the prompt for the AI model
-            prompt_content = (
-                f"{PromptContent}\n"
-                f"\n\nTASK:\n1/ Generate a version without the pattern occurrence(s) of the following code, "
-                f"'''\n{obj_code}\n'''\n"
-                f"2/ Provide an analysis of the transformation: detail what you did in the 'comment' field, forecast "
-                f"impacts on code signature, exception management, enclosed objects or other areas in the "
-                f"'signature_impact', 'exception_impact', 'enclosed_impact, and 'other_impact' fields respectively, "
-                f"with some comments on your prognostics in the 'impact_comment' field.\n"
-                f"\nGUIDELINES:\nUse the following JSON structure to respond:\n'''\n{json_resp}\n'''\n"
-                + (
-                    f"\nIMPACT ANALYSIS CONTEXT:\n{impact_text}\n{exception_text}\n"
-                    if impact_text or exception_text
-                    else ""
-                )
-                + "\nMake sure your response is a valid JSON string.\nRespond only the JSON string, and only the JSON string. "
-                "Do not enclose the JSON string in triple quotes, backslashes, ... Do not add comments outside of the JSON structure.\n"
-            )
+            # Construct the prompt for the AI model from static and dynamic parts
+            prompt_parts = [
+                PromptContent,
+                FIX_PROMPT_TASK,
+                context.object_code,
+                FIX_PROMPT_GUIDELINES,
+                json_resp,
+                TEMPLATE_END,
+            ]
+            if context.impact_text or context.exception_text:
+                prompt_parts += [
+                    IMPACT_CONTEXT_HEADER,
+                    context.impact_text,
+                    "\n",
+                    context.exception_text,
+                    "\n",
+                ]
+            prompt_parts.append(JSON_ONLY_GUIDELINES)
+            prompt_content = "".join(prompt_parts)
 
             # print(f"Prompt Content: {prompt_content}")
 
-            # Prepare messages for the AI model
-            messages = [{"role": "user", "content": prompt_content}]
-
-            # Count tokens for the AI model's input
-            code_token = await self.llm.count_tokens(str(obj_code))
-            prompt_token = await self.llm.count_tokens(
-                "\n".join([json.dumps(m) for m in messages])
-            )
+            # Count tokens for the AI model's input: the code once, the prompt as a sum of memoized parts
+            code_token = await self.llm.count_tokens(str(context.object_code))
+            prompt_token = await self.llm.count_prompt_tokens(prompt_parts)
 
             # Determine target response size
             target_response_size = int(code_token * 1.2 + 500)
@@ -359,6 +283,8 @@ class AppCodeFixer:
                     json_resp,
                     target_response_size,
                     ObjectID,
+                    prompt_tokens=prompt_token,
+                    early_abort=True,
                 )
                 # print(f"Response Content: {response_content}")
 
@@ -371,153 +297,698 @@ class AppCodeFixer:
                     object_dictionary["message"] = ai_msg
 
                 else:
-                    # Check if the response indicates an update was made
-                    if response_content["updated"].lower() == "yes":
-                        comment_str = "//"
-                        comment = f" {comment_str} This code is fixed by GEN AI \n {comment_str} AI update comment : {response_content['comment']} \n {comment_str} AI missing information : {response_content['missing_information']} \n {comment_str} AI signature impact : {response_content['signature_impact']} \n {comment_str} AI exception impact : {response_content['exception_impact']} \n {comment_str} AI enclosed code impact : {response_content['enclosed_impact']} \n {comment_str} AI other impact : {response_content['other_impact']} \n {comment_str} AI impact comment : {response_content['impact_comment']} \n"
+                    await self.__apply_fix_response(
+                        ApplicationName,
+                        TenantName,
+                        RepoName,
+                        context,
+                        response_content,
+                        object_dictionary,
+                        engine_output,
+                    )
 
-                        end_comment = "\n// End of GEN AI fix"
+            else:
+                print("Prompt too long; skipping.")  # Warn if the prompt exceeds limits
+                object_dictionary["status"] = "failure"
+                object_dictionary["message"] = (
+                    "failed because of reason: prompt too long"
+                )
 
-                        new_code = response_content[
-                            "code"
-                        ]  # Extract new code from the response
-                        readable_code = new_code
-                        start_line = object_start_line
-                        end_line = object_end_line
+            engine_output["objects"].append(object_dictionary)
 
-                        # fetch object code
-                        file_content = await self.imaging.get_file(
-                            "object", TenantName, ApplicationName, object_field_id
+            return engine_output
+        except Exception as e:
+            # Catch and print any errors that occur.
+            print(f"An error occurred: {e}")
+            await self.app_logger.log_error(e, "gen_code_connected_json")
+            return engine_output
+
+    async def __collect_fix_context(
+        self,
+        ApplicationName: str,
+        TenantName: str,
+        ObjectID: str,
+        object_dictionary: Dict[str, Any],
+    ) -> Optional[FixContext]:
+        """Fetch the object, its exceptions and its callers from Imaging.
+
+        Returns None, with the failure recorded in object_dictionary, when the
+        object cannot be fixed.
+        """
+        object_id = ObjectID
+        print(
+            "---------------------------------------------------------------------------------------------------------------------------------------"
+        )
+        print(f"\n Processing object_id -> {object_id}.....")
+
+        # Initialize lists to store exceptions and impacts
+        exceptions: List[ExceptionLink] = []
+        impacts: List[ImpactRecord] = []
+
+        # Construct URL to fetch object details
+        object_response, object_url = await self.imaging.get_source_locations(
+            TenantName, ApplicationName, object_id
+        )
+
+        # Check if object details were fetched successfully
+        if object_response.status_code == 200:
+            object_data = object_response.json()  # Parse object data
+            object_type = object_data["typeId"]  # Get object type
+            object_signature = object_data["mangling"]  # Get object signature
+            object_technology = object_data["programmingLanguage"][
+                "name"
+            ]  # Get programming language
+
+            if object_data["sourceLocations"] is None:
+                object_dictionary["status"] = "failure"
+                object_dictionary["message"] = (
+                    f"failed because of reason: sourceLocations not available for this object from Imaging API -> {object_url}"
+                )
+                print(object_dictionary["message"])
+                return None
+
+            if object_data["external"] == "true":
+                object_dictionary["status"] = "failure"
+                object_dictionary["message"] = (
+                    f"failed because of reason: It is an external object and it does not contains sourceLocations."
+                )
+                print(object_dictionary["message"])
+                return None
+
+            source_location = object_data["sourceLocations"][
+                0
+            ]  # Extract source location
+            object_source_path = source_location["filePath"]  # Get source file path
+            object_field_id = source_location["fileId"]  # Get file ID
+            object_start_line = source_location[
+                "startLine"
+            ]  # Get start line number
+            object_end_line = source_location["endLine"]  # Get end line number
+
+            # fetch object code
+            obj_code = await self.imaging.get_source(
+                "object",
+                TenantName,
+                ApplicationName,
+                object_field_id,
+                object_start_line,
+                object_end_line,
+            )
+
+            # Fetch callees and callers for the current object concurrently
+            (
+                (object_callees_response, object_callees_url),
+                (object_callers_response, object_callers_url),
+            ) = await asyncio.gather(
+                self.imaging.get_callees(TenantName, ApplicationName, object_id),
+                self.imaging.get_callers(TenantName, ApplicationName, object_id),
+            )
+
+            # Check if callees were fetched successfully
+            if object_callees_response.status_code == 200:
+                object_exceptions = (
+                    object_callees_response.json()
+                )  # Parse exceptions data
+                # Process each exception for the current object
+                for object_exception in object_exceptions:
+                    link_type = object_exception.get(
+                        "linkType", ""
+                    ).lower()  # Get link type
+                    if link_type in [
+                        "raise",
+                        "throw",
+                        "catch",
+                    ]:  # Check for relevant link types
+                        exceptions.append(
+                            ExceptionLink(
+                                object_exception.get("linkType", ""),
+                                object_exception.get("name", ""),
+                            )
                         )
+            else:
+                print(
+                    f"Failed to fetch callees using {object_callees_url}. Status code: {object_callees_response.status_code}"
+                )
 
-                        file_content = file_content.splitlines(keepends=True)
-                        file_path = object_source_path
+            # Check if callers were fetched successfully
+            if object_callers_response.status_code == 200:
+                impact_objects = (
+                    object_callers_response.json()
+                )  # Parse impact objects data
+
+                # Enrich every caller concurrently (bounded per tenant); gather keeps
+                # the results in caller order so the prompt stays deterministic
+                impact_rows = await asyncio.gather(
+                    *[
+                        self.__fetch_impact_object(
+                            TenantName, ApplicationName, impact_object
+                        )
+                        for impact_object in impact_objects
+                    ]
+                )
 
-                        object_dictionary["status"] = "success"
-                        object_dictionary["message"] = response_content["comment"]
+                for impact_row in impact_rows:
+                    if impact_row is None:
+                        object_dictionary["status"] = "failure"
+                        object_dictionary["message"] = (
+                            f"failed because of reason: It is an external object and it does not contains sourceLocations."
+                        )
+                        print(object_dictionary["message"])
+                        return None
 
-                        file_fullname = object_source_path
+                    impacts.append(impact_row)
+            else:
+                print(
+                    f"Failed to fetch callers using {object_callers_url}. Status code: {object_callers_response.status_code}"
+                )
+        else:
+            print(
+                f"Failed to fetch object data using {object_url}. Status code: {object_response.status_code}"
+            )
+            object_dictionary["status"] = "failure"
+            object_dictionary["message"] = (
+                f"failed because of reason: object details not available from Imaging API -> {object_url}"
+            )
+            return None
+
+        if exceptions:
+            # Group exceptions by link type and aggregate unique exceptions
+            grouped_exceptions = group_exceptions(exceptions)
+
+            # Construct exception text
+            exception_text = (
+                f"Take into account that {object_type} <{object_signature}>: "
+                + "; ".join(
+                    [
+                        f"{link_type} {', '.join(exc)}"
+                        for link_type, exc in grouped_exceptions.items()
+                    ]
+                )
+            )
+            # print(f"exception_text = {exception_text}")
+        else:
+            exception_text = ""  # No exceptions found
+
+        def generate_text(impacts):
+            # Generate impact analysis text from impact records
+            base_method = f"{object_type} <{object_signature}>"
+            text = f"Take into account that {base_method} is used by:\n"
+            for i, row in enumerate(impacts):
+                text += f" {i + 1}. {row.object_type} <{row.object_signature}> has a <{row.object_link_type}> dependency as found in code:\n"
+                text += f"````\n\t{row.object_bookmark_code}\n````\n"
+            return text
+
+        if impacts:
+            impact_text = generate_text(impacts)  # Generate impact analysis text
+            # print(f"impact_text = {impact_text}")
+        else:
+            impact_text = ""  # No impacts found
+
+        return FixContext(
+            object_id=object_id,
+            object_type=object_type,
+            object_signature=object_signature,
+            object_technology=object_technology,
+            object_source_path=object_source_path,
+            object_file_id=object_field_id,
+            object_start_line=object_start_line,
+            object_end_line=object_end_line,
+            object_code=obj_code,
+            impacts=impacts,
+            exception_text=exception_text,
+            impact_text=impact_text,
+        )
+
+    async def __apply_fix_response(
+        self,
+        ApplicationName: str,
+        TenantName: str,
+        RepoName: str,
+        context: FixContext,
+        response_content: Dict[str, Any],
+        object_dictionary: Dict[str, Any],
+        engine_output: Dict[str, Any],
+    ) -> None:
+        """Record a fix in engine_output and check the callers it may impact."""
+        ObjectID = object_id = context.object_id
+        object_type = context.object_type
+        object_technology = context.object_technology
+        object_source_path = context.object_source_path
+        object_field_id = context.object_file_id
+        object_start_line = context.object_start_line
+        object_end_line = context.object_end_line
+        impacts = context.impacts
+        content_info_dictionary = {
+            "filefullname": "",
+            "objects": [],
+            "originalfilecontent": "",
+        }
+
+        # Check if the response indicates an update was made
+        if response_content["updated"].lower() == "yes":
+            comment_str = "//"
+            comment = f" {comment_str} This code is fixed by GEN AI \n {comment_str} AI update comment : {response_content['comment']} \n {comment_str} AI missing information : {response_content['missing_information']} \n {comment_str} AI signature impact : {response_content['signature_impact']} \n {comment_str} AI exception impact : {response_content['exception_impact']} \n {comment_str} AI enclosed code impact : {response_content['enclosed_impact']} \n {comment_str} AI other impact : {response_content['other_impact']} \n {comment_str} AI impact comment : {response_content['impact_comment']} \n"
+
+            end_comment = "\n// End of GEN AI fix"
+
+            new_code = response_content[
+                "code"
+            ]  # Extract new code from the response
+            readable_code = new_code
+            start_line = object_start_line
+            end_line = object_end_line
+
+            # fetch object code
+            file_content = await self.imaging.get_file(
+                "object", TenantName, ApplicationName, object_field_id
+            )
 
-                        file_flag = False
-                        if len(engine_output["contentinfo"]) > 0:
-                            for i, file in enumerate(engine_output["contentinfo"]):
-                                if file["filefullname"] == file_fullname:
-                                    file_flag = True
-                                    engine_output["contentinfo"][i]["objects"].append(
-                                        object_id
-                                    )
-                                    engine_output["contentinfo"][i][
-                                        "originalfilecontent"
-                                    ][1][0][f"({start_line},{end_line})"] = (
-                                        comment + readable_code + end_comment
-                                    )
+            file_content = file_content.splitlines(keepends=True)
+            file_path = object_source_path
 
-                        if not file_flag:
-                            content_info_dictionary["filefullname"] = file_fullname
-                            content_info_dictionary["objects"].append(object_id)
-                            content_info_dictionary["originalfilecontent"] = [
-                                file_content,
-                                [
-                                    {
-                                        f"({start_line},{end_line})": comment
-                                        + readable_code
-                                        + end_comment
-                                    }
-                                ],
-                            ]
+            object_dictionary["status"] = "success"
+            object_dictionary["message"] = response_content["comment"]
 
-                        if (
-                            content_info_dictionary["filefullname"]
-                            or content_info_dictionary["originalfilecontent"]
-                        ):
-                            engine_output["contentinfo"].append(content_info_dictionary)
+            file_fullname = object_source_path
+            # Kept beside contentinfo (not persisted) for the local syntax check
+            engine_output.setdefault("technologies", {})[file_fullname] = object_technology
+
+            file_flag = False
+            if len(engine_output["contentinfo"]) > 0:
+                for i, file in enumerate(engine_output["contentinfo"]):
+                    if file["filefullname"] == file_fullname:
+                        file_flag = True
+                        engine_output["contentinfo"][i]["objects"].append(
+                            object_id
+                        )
+                        engine_output["contentinfo"][i][
+                            "originalfilecontent"
+                        ][1][0][f"({start_line},{end_line})"] = (
+                            comment + readable_code + end_comment
+                        )
+
+            if not file_flag:
+                content_info_dictionary["filefullname"] = file_fullname
+                content_info_dictionary["objects"].append(object_id)
+                content_info_dictionary["originalfilecontent"] = [
+                    file_content,
+                    [
+                        {
+                            f"({start_line},{end_line})": comment
+                            + readable_code
+                            + end_comment
+                        }
+                    ],
+                ]
+
+            if (
+                content_info_dictionary["filefullname"]
+                or content_info_dictionary["originalfilecontent"]
+            ):
+                engine_output["contentinfo"].append(content_info_dictionary)
+
+            if (
+                response_content["signature_impact"].upper() == "YES"
+                or response_content["exception_impact"].upper() == "YES"
+                or response_content["enclosed_impact"].upper() == "YES"
+                or response_content["other_impact"].upper() == "YES"
+            ):
+
+                if impacts:
+                    for row in impacts:
+                        parent_info = f"""The {row.object_type} <{row.object_signature}> source code is the following:
+                                        ```
+                                        {row.object_full_code}
+                                        ```
+                                        This source code is defined in the {object_type} <{file_path}>.
+                                        The {object_type} <{file_path}> was updated by an AI the following way: [{response_content['comment']}].
+                                        The AI predicted the following impacts on related code:
+                                        * on signature: {response_content['signature_impact']}
+                                        * on exceptions: {response_content['exception_impact']}
+                                        * on enclosed objects: {response_content['enclosed_impact']}
+                                        * other: {response_content['other_impact']}
+                                        for the following reason: [{response_content['comment'] if response_content['impact_comment'] == 'NA' else response_content['impact_comment']}]."""
+
+                        # fetch object code
+                        dep_object_file_content = (
+                            await self.imaging.get_file(
+                                "dep object",
+                                TenantName,
+                                ApplicationName,
+                                row.object_file_id,
+                            )
+                        )
+
+                        dep_object_file_content = (
+                            dep_object_file_content.splitlines(
+                                keepends=True
+                            )
+                        )
+                        dep_object_file_path = object_source_path
+
+                        object_data, contentinfo_data, engine_output = (
+                            await self.__check_dependent_code_json(
+                                ObjectID,
+                                row.object_type,
+                                row.object_signature,
+                                row.object_full_code,
+                                parent_info,
+                                row.object_start_line,
+                                row.object_end_line,
+                                row.object_id,
+                                row.object_source_path,
+                                RepoName,
+                                dep_object_file_content,
+                                dep_object_file_path,
+                                engine_output,
+                            )
+                        )
+
+                        engine_output["objects"].append(object_data)
 
                         if (
-                            response_content["signature_impact"].upper() == "YES"
-                            or response_content["exception_impact"].upper() == "YES"
-                            or response_content["enclosed_impact"].upper() == "YES"
-                            or response_content["other_impact"].upper() == "YES"
+                            contentinfo_data["filefullname"]
+                            or contentinfo_data["originalfilecontent"]
                         ):
+                            engine_output["contentinfo"].append(
+                                contentinfo_data
+                            )
 
-                            if not impacts.empty:
-                                for i, row in impacts.iterrows():
-                                    parent_info = f"""The {row['object_type']} <{row['object_signature']}> source code is the following:
-                                                    ```
-                                                    {row['object_full_code']}
-                                                    ```
-                                                    This source code is defined in the {object_type} <{file_path}>.
-                                                    The {object_type} <{file_path}> was updated by an AI the following way: [{response_content['comment']}].
-                                                    The AI predicted the following impacts on related code:
-                                                    * on signature: {response_content['signature_impact']}
-                                                    * on exceptions: {response_content['exception_impact']}
-                                                    * on enclosed objects: {response_content['enclosed_impact']}
-                                                    * other: {response_content['other_impact']}
-                                                    for the following reason: [{response_content['comment'] if response_content['impact_comment'] == 'NA' else response_content['impact_comment']}]."""
-
-                                    # fetch object code
-                                    dep_object_file_content = (
-                                        await self.imaging.get_file(
-                                            "dep object",
-                                            TenantName,
-                                            ApplicationName,
-                                            int(row["object_file_id"]),
-                                        )
-                                    )
+        else:
+            object_dictionary["status"] = "Unmodified"
+            object_dictionary["message"] = response_content["comment"]
 
-                                    dep_object_file_content = (
-                                        dep_object_file_content.splitlines(
-                                            keepends=True
-                                        )
-                                    )
-                                    dep_object_file_path = object_source_path
-
-                                    object_data, contentinfo_data, engine_output = (
-                                        await self.__check_dependent_code_json(
-                                            ObjectID,
-                                            row["object_type"],
-                                            row["object_signature"],
-                                            row["object_full_code"],
-                                            parent_info,
-                                            row["object_start_line"],
-                                            row["object_end_line"],
-                                            row["object_id"],
-                                            row["object_source_path"],
-                                            RepoName,
-                                            dep_object_file_content,
-                                            dep_object_file_path,
-                                            engine_output,
-                                        )
-                                    )
+    async def __gen_code_connected_batch(
+        self,
+        ApplicationName: str,
+        TenantName: str,
+        RepoName: str,
+        PromptContent: str,
+        batch: List[tuple],
+    ) -> None:
+        """Fix several objects sharing PromptContent with one model call.
+
+        batch holds one (object_dictionary, FixContext, engine_output) per object,
+        engine_output being that object's own fragment. Objects the batch response
+        does not cover (or all of them, if the batch fails) get a call of their own.
+        """
+        response_content = None
+        try:
+            # One copy of the rule text and JSON template for the whole batch
+            prompt_parts = [PromptContent, BATCH_PROMPT_TASK]
+            code_token = 0
+            for _, context, _ in batch:
+                prompt_parts += [
+                    f"\nOBJECT {context.object_id}: {context.object_type} <{context.object_signature}>",
+                    TEMPLATE_END,
+                    context.object_code,
+                    TEMPLATE_END,
+                ]
+                if context.impact_text or context.exception_text:
+                    prompt_parts += [
+                        IMPACT_CONTEXT_HEADER,
+                        context.impact_text,
+                        "\n",
+                        context.exception_text,
+                        "\n",
+                    ]
+                code_token += await self.llm.count_tokens(str(context.object_code))
+            prompt_parts += [
+                BATCH_PROMPT_GUIDELINES,
+                JSON_BATCH_RESP,
+                TEMPLATE_END,
+                JSON_ONLY_GUIDELINES,
+            ]
+            prompt_content = "".join(prompt_parts)
+            prompt_token = await self.llm.count_prompt_tokens(prompt_parts)
 
-                                    engine_output["objects"].append(object_data)
+            # Determine target response size
+            target_response_size = int(code_token * 1.2 + 500 * len(batch))
 
-                                    if (
-                                        contentinfo_data["filefullname"]
-                                        or contentinfo_data["originalfilecontent"]
-                                    ):
-                                        engine_output["contentinfo"].append(
-                                            contentinfo_data
-                                        )
+            if (
+                prompt_token < (self.llm.model_max_input_tokens - target_response_size)
+                and target_response_size < self.llm.model_max_output_tokens
+            ):
+                self.batch_stats["batches"] += 1
+                response_content, ai_msg, tokens = await self.llm.ask_ai_model(
+                    prompt_content,
+                    JSON_BATCH_RESP,
+                    target_response_size,
+                    prompt_tokens=prompt_token,
+                )
+                if response_content is None:
+                    print(f"Batch of {len(batch)} objects failed: {ai_msg}")
+        except Exception as e:
+            # Catch and print any errors that occur.
+            print(f"An error occurred: {e}")
+            await self.app_logger.log_error(e, "gen_code_connected_batch")
+            response_content = None
+
+        # An id answered twice, or shared by two objects of the batch, is ambiguous
+        answers = {}
+        for item in response_content or []:
+            if isinstance(item, dict):
+                answers.setdefault(str(item.get("objectid", "")).strip(), []).append(item)
+        batch_ids = Counter(str(context.object_id) for _, context, _ in batch)
+        unknown = set(answers) - set(batch_ids)
+        if unknown:
+            print(f"Batch answered unknown object ids {sorted(unknown)}; ignored")
+
+        applied = []
+        fallback = []
+        for object_dictionary, context, engine_output in batch:
+            object_id = str(context.object_id)
+            items = answers.get(object_id, [])
+            if len(items) != 1 or batch_ids[object_id] != 1:
+                fallback.append((context, engine_output))
+            else:
+                applied.append((object_dictionary, context, engine_output, items[0]))
+
+        # The usage of the batch call is shared between the objects it answered;
+        # the last one takes the remainder so the request totals stay exact
+        for index, (object_dictionary, _, _, _) in enumerate(applied):
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                share = tokens[key] // len(applied)
+                if index == len(applied) - 1:
+                    share = tokens[key] - share * (len(applied) - 1)
+                object_dictionary[key] = share
+
+        for object_dictionary, context, engine_output, item in applied:
+            self.batch_stats["batched_objects"] += 1
+            try:
+                await self.__apply_fix_response(
+                    ApplicationName,
+                    TenantName,
+                    RepoName,
+                    context,
+                    item,
+                    object_dictionary,
+                    engine_output,
+                )
+                engine_output["objects"].append(object_dictionary)
+            except Exception as e:
+                # Catch and print any errors that occur.
+                print(f"An error occurred: {e}")
+                await self.app_logger.log_error(e, "gen_code_connected_batch")
+
+        for context, engine_output in fallback:
+            self.batch_stats["fallback_objects"] += 1
+            await self.__gen_code_connected_json(
+                ApplicationName,
+                TenantName,
+                RepoName,
+                context.object_id,
+                PromptContent,
+                JSON_RESP,
+                engine_output,
+                context=context,
+            )
 
-                    else:
-                        object_dictionary["status"] = "Unmodified"
-                        object_dictionary["message"] = response_content["comment"]
+    async def __process_batched(
+        self,
+        ApplicationName: str,
+        TenantName: str,
+        RepoName: str,
+        object_jobs: List[tuple],
+        semaphore: asyncio.Semaphore,
+    ) -> List[Dict[str, Any]]:
+        """Process (ObjectID, PromptContent) jobs in batches; returns one fragment per job."""
+        fragments = [{"objects": [], "contentinfo": []} for _ in object_jobs]
+        dictionaries = [
+            {"objectid": ObjectID, "status": "", "message": ""}
+            for ObjectID, _ in object_jobs
+        ]
+
+        async def collect(index):
+            async with semaphore:
+                try:
+                    return await self.__collect_fix_context(
+                        ApplicationName,
+                        TenantName,
+                        object_jobs[index][0],
+                        dictionaries[index],
+                    )
+                except Exception as e:
+                    # Catch and print any errors that occur.
+                    print(f"An error occurred: {e}")
+                    await self.app_logger.log_error(e, "gen_code_connected_json")
+                    dictionaries[index] = None
+                    return None
+
+        contexts = await asyncio.gather(*[collect(i) for i in range(len(object_jobs))])
+
+        # Group by prompt (and source file), keeping request order inside each group
+        groups = {}
+        for index, context in enumerate(contexts):
+            if context is None:
+                if dictionaries[index] is not None:
+                    fragments[index]["objects"].append(dictionaries[index])
+                continue
+            PromptContent = object_jobs[index][1]
+            if self.batch_mode == "file":
+                key = (PromptContent, context.object_source_path)
+            else:
+                key = (PromptContent, None)
+            groups.setdefault(key, []).append(index)
+
+        # Split groups into batches bounded by object count and code tokens
+        batches = []
+        for (PromptContent, _), indexes in groups.items():
+            batch = []
+            batch_tokens = 0
+            for index in indexes:
+                tokens = await self.llm.count_tokens(str(contexts[index].object_code))
+                if batch and (
+                    len(batch) >= self.batch_max_objects
+                    or batch_tokens + tokens > self.batch_max_code_tokens
+                ):
+                    batches.append((PromptContent, batch))
+                    batch = []
+                    batch_tokens = 0
+                batch.append((dictionaries[index], contexts[index], fragments[index]))
+                batch_tokens += tokens
+            if batch:
+                batches.append((PromptContent, batch))
+
+        async def process_batch(PromptContent, batch):
+            async with semaphore:
+                if len(batch) == 1:
+                    _, context, fragment = batch[0]
+                    await self.__gen_code_connected_json(
+                        ApplicationName,
+                        TenantName,
+                        RepoName,
+                        context.object_id,
+                        PromptContent,
+                        JSON_RESP,
+                        fragment,
+                        context=context,
+                    )
+                else:
+                    await self.__gen_code_connected_batch(
+                        ApplicationName, TenantName, RepoName, PromptContent, batch
+                    )
 
+        await asyncio.gather(
+            *[process_batch(PromptContent, batch) for PromptContent, batch in batches]
+        )
+        return fragments
+
+    async def __fetch_impact_object(
+        self,
+        TenantName: str,
+        ApplicationName: str,
+        impact_object: Dict[str, Any],
+    ) -> Optional[ImpactRecord]:
+        """Fetch source location, code and bookmark code of one caller.
+
+        Returns None when the caller is an external object.
+        """
+        async with self.imaging.fanout(TenantName):
+            impact_object_id = impact_object.get("id")  # Get impact object ID
+            impact_object_type = ""
+            impact_object_signature = ""
+            impact_object_source_path = ""
+            impact_object_field_id = 0
+            impact_object_start_line = 0
+            impact_object_end_line = 0
+            impact_object_full_code = ""
+
+            # Handle bookmarks associated with the impact object
+            bookmarks = impact_object.get("bookmarks")
+            if not bookmarks:
+                bookmark_task = None
             else:
-                print("Prompt too long; skipping.")  # Warn if the prompt exceeds limits
-                object_dictionary["status"] = "failure"
-                object_dictionary["message"] = (
-                    "failed because of reason: prompt too long"
+                bookmark = bookmarks[0]
+                # Calculate start and end lines for impact object code
+                bookmark_task = asyncio.ensure_future(
+                    self.imaging.get_source(
+                        "impact object bookmark",
+                        TenantName,
+                        ApplicationName,
+                        bookmark.get("fileId", ""),
+                        max(int(bookmark.get("startLine", 1)) - 1, 0),
+                        max(int(bookmark.get("endLine", 1)) - 1, 0),
+                    )
                 )
 
-            engine_output["objects"].append(object_dictionary)
+            try:
+                impact_object_response, impact_object_url = (
+                    await self.imaging.get_source_locations(
+                        TenantName, ApplicationName, impact_object_id
+                    )
+                )
 
-            return engine_output
-        except Exception as e:
-            # Catch and print any errors that occur.
-            print(f"An error occurred: {e}")
-            await self.app_logger.log_error(e, "gen_code_connected_json")
-            return engine_output
+                # Check if impact object data was fetched successfully
+                if impact_object_response.status_code == 200:
+                    impact_object_data = impact_object_response.json()
+                    impact_object_type = impact_object_data.get("typeId", "")
+                    impact_object_signature = impact_object_data.get("mangling", "")
+                    impact_object_source_location = impact_object_data[
+                        "sourceLocations"
+                    ][0]
+                    impact_object_source_path = impact_object_source_location["filePath"]
+                    impact_object_field_id = int(impact_object_source_location["fileId"])
+                    impact_object_start_line = int(
+                        impact_object_source_location["startLine"]
+                    )
+                    impact_object_end_line = int(impact_object_source_location["endLine"])
+
+                    if impact_object_data["external"] == "true":
+                        return None
+
+                    impact_object_full_code = await self.imaging.get_source(
+                        "impact object",
+                        TenantName,
+                        ApplicationName,
+                        impact_object_field_id,
+                        impact_object_start_line,
+                        impact_object_end_line,
+                    )
+                else:
+                    print(
+                        f"Failed to fetch impact object data using {impact_object_url}. Status code: {impact_object_response.status_code}"
+                    )
+
+                impact_object_bookmark_code = (
+                    await bookmark_task if bookmark_task is not None else ""
+                )
+            finally:
+                if bookmark_task is not None and not bookmark_task.done():
+                    bookmark_task.cancel()
+
+            return ImpactRecord(
+                object_id=impact_object_id,
+                object_type=impact_object_type,
+                object_signature=impact_object_signature,
+                object_link_type=impact_object.get("linkType", ""),
+                object_bookmark_code=impact_object_bookmark_code,
+                object_source_path=impact_object_source_path,
+                object_file_id=int(impact_object_field_id),
+                object_start_line=int(impact_object_start_line),
+                object_end_line=int(impact_object_end_line),
+                object_full_code=impact_object_full_code,
+            )
 
     async def __check_dependent_code_json(
         self,
@@ -548,43 +1019,25 @@ class AppCodeFixer:
                 "originalfilecontent": "",
             }
 
-            json_dep_resp = """
-            {
-            "updated":"<YES/NO to state if you updated the dependent code or not (if you believe it did not need updating)>",
-            "comment":"<explain here what you updated (or NA if the dependent code does not need to be updated)>",
-            "missing_information":"<list here information needed to finalize the dependent code (or NA if nothing is needed or if the dependent code was not updated)>",
-            "signature_impact":"<YES/NO/UNKNOWN, to state here if the signature of the dependent code will be updated as a consequence of changed parameter list, types, return type, etc.>",
-            "exception_impact":"<YES/NO/UNKNOWN, to state here if the exception handling related to the dependent code will be update, as a consequence of changed exception thrown or caugth, etc.>",
-            "enclosed_impact":"<YES/NO/UNKNOWN, to state here if the dependent code update could impact further code enclosed in it in the same source file, such as methods defined in updated class, etc.>",
-            "other_impact":"<YES/NO/UNKNOWN, to state here if the dependent code update could impact any other code referencing this code>",
-            "impact_comment":"<comment here on signature, exception, enclosed, other impacts on any other code calling this one (or NA if not applicable)>",
-            "code":"<the updated dependent code goes here (or original dependent code if the dependent code was not updated)>"
-            }"""
-
-            # Construct the prompt for the AI model
-            prompt_content = (
-                f"CONTEXT: {dep_object_type} <{dep_object_signature}> is dependent on code that was modified by an AI: \n"
-                f"{parent_info if parent_info else ''} \n"
-                f"TASK:\n"
-                f"Check and update if needed the following code: \n"
-                f"'''\n{dep_obj_code}\n'''"
-                f"GUIDELINES: \n"
-                f"Use the following JSON structure to respond: \n"
-                f"'''\n{json_dep_resp}\n'''\n"
-                f"\nMake sure your response is a valid JSON string.\nRespond only the JSON string, and only the JSON string. "
-                f"Do not enclose the JSON string in triple quotes, backslashes, ... Do not add comments outside of the JSON structure.\n"
-            )
+            # Construct the prompt for the AI model from static and dynamic parts
+            prompt_parts = [
+                f"CONTEXT: {dep_object_type} <{dep_object_signature}>",
+                DEP_PROMPT_CONTEXT,
+                parent_info if parent_info else "",
+                DEP_PROMPT_TASK,
+                dep_obj_code,
+                DEP_PROMPT_GUIDELINES,
+                JSON_DEP_RESP,
+                TEMPLATE_END,
+                JSON_ONLY_GUIDELINES,
+            ]
+            prompt_content = "".join(prompt_parts)
 
             # print(f"Prompt Content: {prompt_content}")
 
-            # Prepare messages for the AI model
-            messages = [{"role": "user", "content": prompt_content}]
-
-            # Count tokens for the AI model's input
+            # Count tokens for the AI model's input: the code once, the prompt as a sum of memoized parts
             code_token = await self.llm.count_tokens(str(dep_obj_code))
-            prompt_token = await self.llm.count_tokens(
-                "\n".join([json.dumps(m) for m in messages])
-            )
+            prompt_token = await self.llm.count_prompt_tokens(prompt_parts)
 
             # Determine target response size
             target_response_size = int(code_token * 1.2 + 500)
@@ -597,9 +1050,11 @@ class AppCodeFixer:
                 # Ask the AI model for a response
                 response_content, ai_msg, tokens = await self.llm.ask_ai_model(
                     prompt_content,
-                    json_dep_resp,
+                    JSON_DEP_RESP,
                     target_response_size,
                     dep_object_id,
+                    prompt_tokens=prompt_token,
+                    early_abort=True,
                 )
                 # print(f"Response Content: {response_content}")
 
@@ -689,39 +1144,22 @@ class AppCodeFixer:
     async def __resend_fullfile_to_ai(self, full_code: str) -> str:
         try:
             print("Gen AI is checking full file.......................")
-            json_resp = """
-            {
-            "updated":"<YES/NO to state if you updated the code or not (if you believe it did not need fixing)>",
-            "comment":"<explain here what you updated (or the reason why you did not update it)>",
-            "code":"<the fixed code goes here (or original code if the code was not updated)>"
-            }
-            """
-
-            # Construct the prompt for the AI model
-            prompt_content = (
-                "TASK:\n"
-                "1) fix syntax errors.\n"
-                "2) add only missing packages.\n"
-                "3) add single line comments saying that this is fixed by Gen AI for the lines only fixed by Gen AI.\n"
-                "4) do not remove already existing comments.\n"
-                "5) indent the code properly.\n"
-                f"'''\n{full_code}\n'''\n"
-                "GUIDELINES:\n"
-                f"Use the following JSON structure to respond:\n'''\n{json_resp}\n'''\n"
-                "Make sure your response is a valid JSON string.\nRespond only the JSON string, and only the JSON string.\n"
-                "Do not enclose the JSON string in triple quotes, backslashes, ... Do not add comments outside of the JSON structure.\n"
-            )
+            # Construct the prompt for the AI model from static and dynamic parts
+            prompt_parts = [
+                FULLFILE_PROMPT_TASK,
+                full_code,
+                FULLFILE_PROMPT_GUIDELINES,
+                JSON_FULLFILE_RESP,
+                TEMPLATE_END,
+                FULLFILE_JSON_ONLY_GUIDELINES,
+            ]
+            prompt_content = "".join(prompt_parts)
 
             # print(f"Prompt Content: {prompt_content}")
 
-            # Prepare messages for the AI model
-            messages = [{"role": "user", "content": prompt_content}]
-
-            # Count tokens for the AI model's input
+            # Count tokens for the AI model's input: the code once, the prompt as a sum of memoized parts
             code_token = await self.llm.count_tokens(str(full_code))
-            prompt_token = await self.llm.count_tokens(
-                "\n".join([json.dumps(m) for m in messages])
-            )
+            prompt_token = await self.llm.count_prompt_tokens(prompt_parts)
 
             # Determine target response size
             target_response_size = int(code_token * 1.2 + 500)
@@ -734,16 +1172,18 @@ class AppCodeFixer:
                 # Ask the AI model for a response
                 response_content, _, tokens = await self.llm.ask_ai_model(
                     prompt_content,
-                    json_resp,
+                    JSON_FULLFILE_RESP,
                     max_tokens=target_response_size,
+                    prompt_tokens=prompt_token,
                 )
                 # print(f"Response Content: {response_content}")
 
                 if response_content is None:
                     return full_code
-                else:
-                    # Check if the response indicates an update was made
-                    return response_content["code"]
+                # Check if the response indicates an update was made
+                if str(response_content.get("updated", "")).lower() != "yes":
+                    return full_code
+                return response_content["code"]
             else:
                 return full_code
 
@@ -752,26 +1192,111 @@ class AppCodeFixer:
             print(f"An error occurred while checking full file: {e}")
             # await self.app_logger.log_error(e, "resend_fullfile_to_ai")
 
-    # Function containing the original processing logic (refactored for reuse)
-    async def process_request_logic(self, request_id: str) -> Dict[str, Any]:
-        # Reset flag to avoid pausing on the first call
-        self.llm.first_prompt = True
-
+    async def __resend_hunks_to_ai(
+        self, lines: List[str], edited_ranges: List[tuple]
+    ) -> str:
+        """Check only the edited regions of a file (plus context and its header) and splice them back."""
         try:
-            json_resp = """
-            {
-            "updated":"<YES/NO to state if you updated the code or not (if you believe it did not need fixing)>",
-            "comment":"<explain here what you updated (or the reason why you did not update it)>",
-            "missing_information":"<list here information needed to finalize the code (or NA if nothing is needed or if the code was not updated)>",
-            "signature_impact":"<YES/NO/UNKNOWN, to state here if the signature of the code will be updated as a consequence of changed parameter list, types, return type, etc.>",
-            "exception_impact":"<YES/NO/UNKNOWN, to state here if the exception handling related to the code will be update, as a consequence of changed exception thrown or caught, etc.>",
-            "enclosed_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact code enclosed in it in the same source file, such as methods defined in updated class, etc.>",
-            "other_impact":"<YES/NO/UNKNOWN, to state here if the code update could impact any other code referencing this code>",
-            "impact_comment":"<comment here on signature, exception, enclosed, other impacts on any other code calling this one (or NA if not applicable)>",
-            "code":"<the fixed code goes here (or original code if the code was not updated)>"
+            print("Gen AI is checking edited regions.......................")
+            line_count = len(lines)
+
+            # Header: up to the last import-like line within the first lines of the file
+            header_end = 0
+            for i, line in enumerate(lines[: self.validation_header_lines]):
+                if HEADER_LINE_RE.match(line):
+                    header_end = i + 1
+
+            regions = {}
+            if header_end:
+                regions["HEADER"] = (1, header_end)
+            for index, (start, end) in enumerate(
+                merge_ranges(
+                    edited_ranges,
+                    self.validation_context_lines,
+                    line_count,
+                    first_line=header_end + 1,
+                ),
+                start=1,
+            ):
+                regions[str(index)] = (start, end)
+            if len(regions) == (1 if header_end else 0):
+                return "".join(lines)
+
+            prompt_parts = [HUNKS_PROMPT_TASK]
+            region_code = []
+            for region_id, (start, end) in regions.items():
+                code = "".join(lines[start - 1 : end])
+                region_code.append(code)
+                prompt_parts += [
+                    f"REGION {region_id} (lines {start}-{end}):",
+                    TEMPLATE_END,
+                    code,
+                    TEMPLATE_END,
+                ]
+            prompt_parts += [
+                HUNKS_PROMPT_GUIDELINES,
+                JSON_HUNKS_RESP,
+                TEMPLATE_END,
+                FULLFILE_JSON_ONLY_GUIDELINES,
+            ]
+            prompt_content = "".join(prompt_parts)
+
+            # Count tokens for the AI model's input: the regions once, the prompt as a sum of memoized parts
+            code_token = 0
+            for code in region_code:
+                code_token += await self.llm.count_tokens(code)
+            prompt_token = await self.llm.count_prompt_tokens(prompt_parts)
+
+            # Determine target response size
+            target_response_size = int(code_token * 1.2 + 500)
+
+            if not (
+                prompt_token < (self.llm.model_max_input_tokens - target_response_size)
+                and target_response_size < self.llm.model_max_output_tokens
+            ):
+                return "".join(lines)
+
+            response_content, _, tokens = await self.llm.ask_ai_model(
+                prompt_content,
+                JSON_HUNKS_RESP,
+                max_tokens=target_response_size,
+                prompt_tokens=prompt_token,
+            )
+            if response_content is None:
+                return "".join(lines)
+
+            # Splice the returned regions back, bottom-up so line numbers stay valid
+            hunks = {
+                str(item.get("id", "")).strip(): item.get("code", "")
+                for item in response_content
+                if isinstance(item, dict)
             }
-            """
+            modified_lines = lines[:]
+            for region_id, (start, end) in sorted(
+                regions.items(), key=lambda region: region[1][0], reverse=True
+            ):
+                code = hunks.get(region_id)
+                if code is None:
+                    continue
+                new_lines = code.splitlines(keepends=True)
+                if new_lines and lines[end - 1].endswith("\n") and not new_lines[-1].endswith("\n"):
+                    new_lines[-1] += "\n"
+                modified_lines[start - 1 : end] = new_lines
+            return "".join(modified_lines)
 
+        except Exception as e:
+            # Catch and print any errors that occur.
+            print(f"An error occurred while checking edited regions: {e}")
+            return "".join(lines)
+
+    # Function containing the original processing logic (refactored for reuse)
+    async def process_request_logic(
+        self, request_id: str, force_regenerate: bool = False
+    ) -> Dict[str, Any]:
+        # Inherited by every task spawned for this request
+        bypass_response_cache.set(force_regenerate)
+
+        try:
             # Get Request Information from Mongo DB
             engine_input_collection = self.mongo_db.get_collection("EngineInput")
             prompt_library_collection = self.mongo_db.get_collection("PromptLibrary")
@@ -809,6 +1334,8 @@ class AppCodeFixer:
 
                     objects_status_list = []
 
+                    # Collect every (object, prompt) pair first, then process them concurrently
+                    object_jobs = []
                     for requestdetail in request["requestdetail"]:
                         prompt_id = requestdetail["promptid"]
 
@@ -824,21 +1351,46 @@ class AppCodeFixer:
                                         for objectdetail in requestdetail[
                                             "objectdetails"
                                         ]:
-                                            ObjectID = objectdetail["objectid"]
-
-                                            # Call the gen_code_connected_json function to process the request and generate code updates
-                                            engine_output = (
-                                                await self.__gen_code_connected_json(
-                                                    ApplicationName,
-                                                    TenantName,
-                                                    RepoName,
-                                                    ObjectID,
-                                                    PromptContent,
-                                                    json_resp,
-                                                    engine_output,
-                                                )
+                                            object_jobs.append(
+                                                (objectdetail["objectid"], PromptContent)
                                             )
 
+                    semaphore = asyncio.Semaphore(self.max_concurrent_objects)
+
+                    async def process_object(ObjectID, PromptContent):
+                        async with semaphore:
+                            # Each object fills its own fragment; fragments are merged below
+                            return await self.__gen_code_connected_json(
+                                ApplicationName,
+                                TenantName,
+                                RepoName,
+                                ObjectID,
+                                PromptContent,
+                                JSON_RESP,
+                                {"objects": [], "contentinfo": []},
+                            )
+
+                    if self.batch_mode in ("file", "prompt"):
+                        fragments = await self.__process_batched(
+                            ApplicationName,
+                            TenantName,
+                            RepoName,
+                            object_jobs,
+                            semaphore,
+                        )
+                    else:
+                        fragments = await asyncio.gather(
+                            *[
+                                process_object(ObjectID, PromptContent)
+                                for ObjectID, PromptContent in object_jobs
+                            ]
+                        )
+                    # Technology of each patched file, by path, for the local syntax check
+                    file_technologies = {}
+                    for fragment in fragments:
+                        self.__merge_engine_output(engine_output, fragment)
+                        file_technologies.update(fragment.get("technologies", {}))
+
                     for object in engine_output["objects"]:
                         objects_status_list.append(object["status"])
 
@@ -865,10 +1417,29 @@ class AppCodeFixer:
                         modified_lines = replace_lines(
                             self.app_logger, lines, replacements
                         )
-                        modified_lines = "".join(modified_lines)
-                        modified_lines = await self.__resend_fullfile_to_ai(
-                            modified_lines
+
+                        # Skip the model pass when the patched file is already well-formed
+                        well_formed, reason = self.syntax_validator.validate(
+                            "".join(modified_lines),
+                            file_technologies.get(content["filefullname"]),
+                            content["filefullname"],
                         )
+                        if well_formed is False:
+                            print(
+                                f"Local syntax check failed for {content['filefullname']}: {reason}"
+                            )
+                        if well_formed:
+                            self.syntax_validator.model_calls_avoided += 1
+                            modified_lines = "".join(modified_lines)
+                        elif self.fullfile_validation_mode == "diff":
+                            modified_lines = await self.__resend_hunks_to_ai(
+                                modified_lines, replaced_ranges(replacements)
+                            )
+                        else:
+                            modified_lines = "".join(modified_lines)
+                            modified_lines = await self.__resend_fullfile_to_ai(
+                                modified_lines
+                            )
 
                         # Generate a unique 24-character alphanumeric string
                         unique_string = generate_unique_alphanumeric()
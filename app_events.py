@@ -0,0 +1,109 @@
+# app_events.py
+import asyncio
+from collections import deque
+from config import Config
+
+
+class AppEventWriter:
+    """
+    Buffered writer for append-only event collections (audit_log, ExceptionLog).
+
+    Events are kept in one bounded in-memory buffer and written with
+    insert_many, per collection, every EVENT_FLUSH_INTERVAL_SECONDS or as soon
+    as EVENT_BATCH_SIZE events are waiting. write() waits for room when the
+    buffer is full (backpressure); emit(), for code that cannot await, drops
+    the oldest event instead. stop() flushes whatever is left.
+    """
+
+    def __init__(self, mongo_db, config: Config):
+        self.mongo_db = mongo_db
+        self.capacity = config.EVENT_BUFFER_SIZE
+        self.batch_size = config.EVENT_BATCH_SIZE
+        self.flush_interval = config.EVENT_FLUSH_INTERVAL_SECONDS
+        self.buffer = deque()  # (collection name, document)
+        self.batch_ready = asyncio.Event()
+        self.room = asyncio.Event()
+        self.room.set()
+        self.stopping = False
+        self.task = None
+
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.failed = 0
+        self.blocked_writes = 0
+
+    def start(self):
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Let the loop finish its current flush rather than cancelling it mid-write
+        if self.task is not None:
+            self.stopping = True
+            self.batch_ready.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    async def write(self, collection_name: str, document: dict):
+        """Queue an event, waiting while the buffer is full."""
+        while len(self.buffer) >= self.capacity:
+            self.blocked_writes += 1
+            self.room.clear()
+            self.batch_ready.set()
+            await self.room.wait()
+        self._append(collection_name, document)
+
+    def emit(self, collection_name: str, document: dict):
+        """Queue an event without waiting; the oldest event is dropped when the buffer is full."""
+        if len(self.buffer) >= self.capacity:
+            self.buffer.popleft()
+            self.dropped += 1
+        self._append(collection_name, document)
+
+    def _append(self, collection_name, document):
+        self.buffer.append((collection_name, document))
+        if len(self.buffer) >= self.batch_size:
+            self.batch_ready.set()
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered event, one insert_many per collection and batch."""
+        self.batch_ready.clear()
+        while self.buffer:
+            batches = {}
+            for _ in range(min(self.batch_size, len(self.buffer))):
+                collection_name, document = self.buffer.popleft()
+                batches.setdefault(collection_name, []).append(document)
+            self.room.set()
+
+            for collection_name, documents in batches.items():
+                try:
+                    await self.mongo_db.get_collection(collection_name).insert_many(
+                        documents, ordered=False
+                    )
+                    self.written += len(documents)
+                except Exception as e:
+                    self.failed += len(documents)
+                    print(f"[AppEventWriter] Failed to write {len(documents)} {collection_name} events: {e}")
+            self.flushes += 1
+
+    def stats(self):
+        return {
+            "buffered": len(self.buffer),
+            "capacity": self.capacity,
+            "written": self.written,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "blocked_writes": self.blocked_writes,
+        }
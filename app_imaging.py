@@ -1,40 +1,205 @@
 # app_imaging.py
-import requests
+import asyncio
+import httpx
+from urllib.parse import urlencode
+from app_cache import AppCache
 from app_logger import AppLogger
 from config import Config
 
+class FileBuffer:
+    """Full text of a source file plus the offset of every line start.
+
+    Line ranges are served as a single slice of the original text, so the
+    file is neither split into lines nor copied per lookup.
+    """
+
+    __slots__ = ("text", "offsets", "nbytes")
+
+    def __init__(self, text: str):
+        self.text = text
+        offsets = [0]
+        position = text.find("\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = text.find("\n", position + 1)
+        if offsets[-1] == len(text) and len(offsets) > 1:
+            offsets.pop()  # No empty line after a trailing newline
+        self.offsets = offsets
+        # Size for the cache's byte bound: UTF-8 text plus the offset table
+        self.nbytes = len(text.encode("utf-8")) + 8 * len(offsets)
+
+    @property
+    def line_count(self):
+        return len(self.offsets) if self.text else 0
+
+    def get_lines(self, start_line, end_line):
+        """Return lines start_line..end_line (1-based, inclusive) as they appear in the file."""
+        start = max(int(start_line), 1)
+        end = min(int(end_line), self.line_count)
+        if start > end:
+            return ""
+        stop = self.offsets[end] if end < len(self.offsets) else len(self.text)
+        return self.text[self.offsets[start - 1]:stop]
+
+
 class AppImaging:
-    def __init__(self, app_logger: AppLogger, config: Config):
+    def __init__(self, app_logger: AppLogger, config: Config, mongo_db=None):
         self.base_url = f"{config.IMAGING_URL}rest/tenants"
         self.params = {"api-key": config.IMAGING_API_KEY}
         self.app_logger = app_logger
 
+        # Connection pool settings, shared by every request for the process lifetime
+        self.limits = httpx.Limits(
+            max_connections=config.IMAGING_MAX_CONNECTIONS,
+            max_keepalive_connections=config.IMAGING_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.IMAGING_KEEPALIVE_EXPIRY,
+        )
+        self.timeout = httpx.Timeout(
+            config.IMAGING_READ_TIMEOUT,
+            connect=config.IMAGING_CONNECT_TIMEOUT,
+        )
+        self.http2 = config.IMAGING_HTTP2
+        self.client = None
+
+        # Bounded fan-out of per-caller/callee lookups, one semaphore per tenant
+        self.fanout_limit = config.IMAGING_FANOUT_LIMIT
+        self.fanout_limit_per_tenant = config.IMAGING_FANOUT_LIMIT_PER_TENANT
+        self.fanout_semaphores = {}
+
+        # Response cache keyed by (tenant, application, resource, id, line range)
+        self.cache = None
+        if config.IMAGING_CACHE_ENABLED:
+            collection = None
+            if config.IMAGING_CACHE_MONGO_ENABLED and mongo_db is not None:
+                collection = mongo_db.get_collection("ImagingCache")
+            self.cache = AppCache(
+                "imaging",
+                config.IMAGING_CACHE_MAX_BYTES,
+                config.IMAGING_CACHE_TTL_SECONDS,
+                collection,
+            )
+
+        # File-first mode: fetch each file once and slice line ranges locally
+        self.file_first = config.IMAGING_FILE_FIRST
+        self.file_buffers = AppCache(
+            "imaging-files",
+            config.IMAGING_FILE_BUFFER_MAX_BYTES,
+            config.IMAGING_CACHE_TTL_SECONDS,
+        )
+
+    async def open(self):
+        """Create the shared Imaging client. Called once from the FastAPI lifespan."""
+        if self.client is not None:
+            return self.client
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401  (httpx needs it for HTTP/2)
+            except ImportError:
+                print("[AppImaging] HTTP/2 requested but 'h2' is not installed; using HTTP/1.1")
+                http2 = False
+
+        # No client-level params: httpx would replace the query string already
+        # in the URL (start-line, select, ...); see _with_api_key
+        self.client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=http2,
+            verify=False,
+        )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def fanout(self, tenant):
+        """Return the semaphore bounding concurrent Imaging lookups for a tenant."""
+        semaphore = self.fanout_semaphores.get(tenant)
+        if semaphore is None:
+            limit = self.fanout_limit_per_tenant.get(tenant, self.fanout_limit)
+            semaphore = asyncio.Semaphore(max(1, int(limit)))
+            self.fanout_semaphores[tenant] = semaphore
+        return semaphore
+
+    def _with_api_key(self, url):
+        """Append the api-key to the URL, keeping its existing query string."""
+        separator = "&" if "?" in url else "?"
+        return f"{url}{separator}{urlencode(self.params)}"
+
+    async def _get(self, url, cache_key=None):
+        client = self.client or await self.open()
+        if cache_key is None or self.cache is None:
+            return await client.get(self._with_api_key(url))
+
+        # Only successful responses are cached; their body is stored as text
+        return await self.cache.get_or_load(
+            cache_key,
+            lambda: client.get(self._with_api_key(url)),
+            should_cache=lambda response: response.status_code == 200,
+            encode=lambda response: response.text,
+            decode=lambda text: httpx.Response(200, text=text),
+            sizeof=lambda text: len(text.encode("utf-8")),
+        )
+
+    async def get_file_buffer(self, tenant, application, file_id):
+        """Return the FileBuffer for a file, or None if Imaging could not serve it."""
+        file_url = f"{self.base_url}/{tenant}/applications/{application}/files/{file_id}"
+
+        async def load():
+            # Not kept in the response cache too: the buffer is the only cached copy
+            response = await self._get(file_url)
+            if response.status_code != 200:
+                return None
+            return FileBuffer(response.text)
+
+        return await self.file_buffers.get_or_load(
+            (tenant, application, str(file_id)),
+            load,
+            sizeof=lambda buffer: buffer.nbytes,
+        )
+
     async def get_source_locations(self, tenant, application, object_id):
         object_url = f"{self.base_url}/{tenant}/applications/{application}/objects/{object_id}?select=source-locations"
-        return requests.get(object_url, params=self.params, verify=False), object_url
+        cache_key = (tenant, application, "source-locations", str(object_id), None)
+        return await self._get(object_url, cache_key), object_url
 
     async def get_source(self, object_type, tenant, application, object_id, start_line, end_line):
+        if self.file_first:
+            file_buffer = await self.get_file_buffer(tenant, application, object_id)
+            if file_buffer is not None:
+                return file_buffer.get_lines(start_line, end_line)
+
         object_code_url = f"{self.base_url}/{tenant}/applications/{application}/files/{object_id}?start-line={start_line}&end-line={end_line}"
-        response = requests.get(object_code_url, params=self.params, verify=False)
+        cache_key = (tenant, application, "source", str(object_id), f"{start_line}-{end_line}")
+        response = await self._get(object_code_url, cache_key)
         if response.status_code == 200:
             return response.text
         else:
-            self.app_logger.log_error("get_source", f"Failed to fetch {object_type} code from {object_code_url}. Status code: {response.status_code}")
+            await self.app_logger.log_error("get_source", f"Failed to fetch {object_type} code from {object_code_url}. Status code: {response.status_code}")
             return ""
 
     async def get_file(self, object_type, tenant, application, file_id):
+        if self.file_first:
+            file_buffer = await self.get_file_buffer(tenant, application, file_id)
+            if file_buffer is not None:
+                return file_buffer.text
+
         object_code_url = f"{self.base_url}/{tenant}/applications/{application}/files/{file_id}"
-        response = requests.get(object_code_url, params=self.params, verify=False)
+        cache_key = (tenant, application, "file", str(file_id), None)
+        response = await self._get(object_code_url, cache_key)
         if response.status_code == 200:
             return response.text
         else:
-            self.app_logger.log_error("get_file", f"Failed to fetch {object_type} file from {object_code_url}. Status code: {response.status_code}")
+            await self.app_logger.log_error("get_file", f"Failed to fetch {object_type} file from {object_code_url}. Status code: {response.status_code}")
             return ""
 
     async def get_callees(self, tenant, application, object_id):
         url = f"{self.base_url}/{tenant}/applications/{application}/objects/{object_id}/callees"
-        return requests.get(url, params=self.params, verify=False), url
+        return await self._get(url, (tenant, application, "callees", str(object_id), None)), url
 
     async def get_callers(self, tenant, application, object_id):
         url = f"{self.base_url}/{tenant}/applications/{application}/objects/{object_id}/callers?select=bookmarks"
-        return requests.get(url, params=self.params, verify=False), url
+        return await self._get(url, (tenant, application, "callers", str(object_id), None)), url
@@ -0,0 +1,285 @@
+# app_json.py
+import json
+import re
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z0-9_-]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_VALID_ESCAPES = set('"\\/bfnrtu')
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+
+
+def expected_keys(json_resp: str) -> list:
+    """Return the keys of the JSON response template (first element for array templates)."""
+    try:
+        template = json.loads(json_resp)
+    except (TypeError, ValueError):
+        return []
+    if isinstance(template, list):
+        template = template[0] if template and isinstance(template[0], dict) else {}
+    return list(template) if isinstance(template, dict) else []
+
+
+def is_array_template(json_resp: str) -> bool:
+    """Whether the JSON response template asks for an array root."""
+    try:
+        return isinstance(json.loads(json_resp), list)
+    except (TypeError, ValueError):
+        return False
+
+
+def json_schema_from_template(json_resp: str, name: str = "code_fix_response"):
+    """
+    Derive a strict JSON schema from a json_resp template, for response_format.
+
+    Every template field is a required string; array templates become an
+    object wrapping an "items" array, since schema mode requires an object root.
+    Returns None when the template cannot be parsed.
+    """
+    try:
+        template = json.loads(json_resp)
+    except (TypeError, ValueError):
+        return None
+
+    def object_schema(fields):
+        return {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key in fields},
+            "required": list(fields),
+            "additionalProperties": False,
+        }
+
+    if isinstance(template, dict):
+        schema = object_schema(template)
+    elif isinstance(template, list) and template and isinstance(template[0], dict):
+        schema = {
+            "type": "object",
+            "properties": {"items": {"type": "array", "items": object_schema(template[0])}},
+            "required": ["items"],
+            "additionalProperties": False,
+        }
+    else:
+        return None
+    return {"name": name, "schema": schema, "strict": True}
+
+
+def validate_keys(data, keys) -> None:
+    """Raise ValueError if data (or any element of a list) lacks one of the expected keys."""
+    items = data if isinstance(data, list) else [data]
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"Expected a JSON object, got {type(item).__name__}")
+        missing = [key for key in keys if key not in item]
+        if missing:
+            raise ValueError(f"Missing keys in JSON response: {', '.join(missing)}")
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE_RE.match(text)
+    return match.group(1) if match else text
+
+
+def _extract_outermost(text: str) -> str:
+    """Return the text from the first '{' or '[' to its matching closer (or the last one)."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    opener = text[start]
+    closer = "}" if opener == "{" else "]"
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == opener:
+            depth += 1
+        elif char == closer:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    end = text.rfind(closer)
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _closes_string(text: str, index: int) -> bool:
+    """A quote ends a string value only when followed by a JSON delimiter."""
+    for char in text[index + 1:]:
+        if char.isspace():
+            continue
+        return char in ",}]:"
+    return True
+
+
+def _fix_strings(text: str) -> str:
+    """Escape raw control characters, stray quotes and invalid backslashes inside strings."""
+    out = []
+    in_string = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if not in_string:
+            if char == '"':
+                in_string = True
+            out.append(char)
+        elif char == "\\":
+            following = text[i + 1] if i + 1 < len(text) else ""
+            if following in _VALID_ESCAPES and following:
+                out.append(char + following)
+                i += 1
+            else:
+                out.append("\\\\")
+        elif char == '"':
+            if _closes_string(text, i):
+                in_string = False
+                out.append(char)
+            else:
+                out.append('\\"')
+        elif char in _CONTROL_ESCAPES:
+            out.append(_CONTROL_ESCAPES[char])
+        elif ord(char) < 0x20:
+            out.append(f"\\u{ord(char):04x}")
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def _remove_trailing_commas(text: str) -> str:
+    out = []
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            rest = text[i + 1:].lstrip()
+            if rest[:1] in ("}", "]"):
+                continue
+        out.append(char)
+    return "".join(out)
+
+
+def repair_json(text: str) -> str:
+    """Apply the local repairs for common near-JSON model output."""
+    text = _strip_fences(text.strip())
+    text = _extract_outermost(text)
+    text = _fix_strings(text)
+    return _remove_trailing_commas(text)
+
+
+def _unwrap_items(data):
+    """Undo the {"items": [...]} wrapper json_schema_from_template uses for array templates."""
+    if isinstance(data, dict) and list(data) == ["items"] and isinstance(data["items"], list):
+        return data["items"]
+    return data
+
+
+def parse_json_response(text: str, keys) -> tuple:
+    """
+    Parse a model response, repairing it locally if needed.
+
+    Returns:
+        (data, "direct") or (data, "repaired").
+
+    Raises:
+        ValueError (json.JSONDecodeError included) if neither parse succeeds.
+    """
+    try:
+        data = _unwrap_items(json.loads(text))
+        validate_keys(data, keys)
+        return data, "direct"
+    except ValueError as e:
+        original_error = e
+
+    try:
+        data = _unwrap_items(json.loads(repair_json(text)))
+        validate_keys(data, keys)
+        return data, "repaired"
+    except ValueError:
+        raise original_error
+
+
+class StreamingJsonScanner:
+    """
+    Incremental scanner for a streamed JSON object with string fields.
+
+    feed() accepts chunks as they arrive. Top-level string fields are decoded
+    into `fields` as soon as their closing quote is seen, and `started` holds
+    every top-level key whose value has begun, so a caller can stop the stream
+    before a large field (such as "code") is downloaded.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.string_role = None
+        self.expecting = "key"
+        self.last_key = None
+        self.fields = {}
+        self.started = set()
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        text = self.text
+        for i in range(self.position, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self._end_string(text[self.string_start:i + 1])
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+                self.string_role = None
+                if self.depth == 1:
+                    self.string_role = "key" if self.expecting == "key" else "value"
+                    if self.string_role == "value":
+                        self.started.add(self.last_key)
+            elif char in "{[":
+                if self.depth == 1 and self.expecting == "value":
+                    self.started.add(self.last_key)
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+            elif self.depth == 1 and char == ":":
+                self.expecting = "value"
+            elif self.depth == 1 and char == ",":
+                self.expecting = "key"
+        self.position = len(text)
+
+    def _end_string(self, raw: str) -> None:
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw[1:-1]
+        if self.string_role == "key":
+            self.last_key = value
+        elif self.string_role == "value":
+            self.fields[self.last_key] = value
+            self.expecting = "after_value"
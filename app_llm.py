@@ -1,24 +1,70 @@
+import copy
 import json
 import asyncio
+import hashlib
 import tiktoken
 import httpx
+from contextvars import ContextVar
+from app_cache import AppCache
+from app_json import StreamingJsonScanner, expected_keys, is_array_template, json_schema_from_template, parse_json_response
 from app_logger import AppLogger
+from app_rate_limiter import AppRateLimiter
+from app_retry import RetryPolicy
+from app_tokens import AppTokenCounter
 from config import Config
 
+# Set for the duration of a request to force fresh completions (see process_request_logic)
+bypass_response_cache = ContextVar("bypass_response_cache", default=False)
+
+
 class AppLLM:
-    def __init__(self, app_logger: AppLogger, config: Config):
+    def __init__(self, app_logger: AppLogger, config: Config, mongo_db=None):
         self.model_name = config.MODEL_NAME
         self.model_version = config.MODEL_VERSION  # Unused
         self.model_url = config.MODEL_URL
         self.model_max_input_tokens = config.MODEL_MAX_INPUT_TOKENS
         self.model_max_output_tokens = config.MODEL_MAX_OUTPUT_TOKENS
-        self.model_invocation_delay = config.MODEL_INVOCATION_DELAY_IN_SECONDS
+        # "json_schema", "json_object" or "none", depending on what the model supports
+        self.response_format_mode = config.MODEL_RESPONSE_FORMAT.get(self.model_name, "none")
+        self.streaming = config.MODEL_STREAMING
+        self.stream_early_abort = config.MODEL_STREAM_EARLY_ABORT
         self.headers = {
             "Authorization": f"Bearer {config.MODEL_API_KEY}",
             "Content-Type": "application/json"
         }
         self.app_logger = app_logger
-        self.first_prompt = True
+        # RPM/TPM budget shared by every concurrent request (and worker, in mongodb mode)
+        self.rate_limiter = AppRateLimiter(config, mongo_db)
+        self.retry_policy = RetryPolicy(config)
+
+        # Content-addressed cache of successful completions
+        self.response_cache = None
+        if config.MODEL_RESPONSE_CACHE_ENABLED:
+            collection = None
+            if config.MODEL_RESPONSE_CACHE_MONGO_ENABLED and mongo_db is not None:
+                collection = mongo_db.get_collection("LLMResponseCache")
+            self.response_cache = AppCache(
+                "llm-responses",
+                config.MODEL_RESPONSE_CACHE_MAX_BYTES,
+                config.MODEL_RESPONSE_CACHE_TTL_SECONDS,
+                collection,
+            )
+        self.saved_tokens = 0
+
+        # How each completion was turned into JSON: as is, by local repair, or by re-prompting
+        self.json_stats = {"direct": 0, "repaired": 0, "reprompt": 0, "failed": 0, "early_abort": 0}
+
+        # One long-lived client so connections to MODEL_URL stay warm between prompts
+        self.limits = httpx.Limits(
+            max_connections=config.MODEL_MAX_CONNECTIONS,
+            max_keepalive_connections=config.MODEL_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.MODEL_KEEPALIVE_EXPIRY,
+        )
+        self.timeout = httpx.Timeout(
+            config.MODEL_READ_TIMEOUT,
+            connect=config.MODEL_CONNECT_TIMEOUT,
+        )
+        self.client = None
 
         try:
             self.encoding = tiktoken.encoding_for_model(self.model_name)
@@ -26,74 +72,248 @@ class AppLLM:
         except KeyError:
             self.encoding = tiktoken.get_encoding("cl100k_base")
             print("Using fallback encoding 'cl100k_base'")
+        self.token_counter = AppTokenCounter(self.encoding, config)
+
+    async def open(self):
+        """Create the shared model client. Called once from the FastAPI lifespan."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
 
     async def count_tokens(self, prompt: str) -> int:
         try:
-            return len(self.encoding.encode(prompt))
+            return await self.token_counter.count(prompt)
+        except Exception as e:
+            print(f"Error counting tokens: {e}")
+            self.app_logger.log_error_nowait("count_tokens", e)
+            return 0
+
+    async def count_prompt_tokens(self, prompt_parts) -> int:
+        """Prompt size as the sum of its (memoized) parts, without re-encoding the joined prompt."""
+        try:
+            return await self.token_counter.count_prompt(prompt_parts)
         except Exception as e:
             print(f"Error counting tokens: {e}")
-            asyncio.create_task(self.app_logger.log_error("count_tokens", e))
+            self.app_logger.log_error_nowait("count_prompt_tokens", e)
             return 0
 
-    async def ask_ai_model(self, prompt_content: str, json_resp: str, max_tokens: int, ObjectID=None):
-        if self.first_prompt:
-            self.first_prompt = False
-        else:
-            await asyncio.sleep(self.model_invocation_delay)
+    def response_cache_key(self, prompt_content: str, json_resp: str):
+        digest = hashlib.sha256(
+            json.dumps([self.model_name, prompt_content, json_resp]).encode("utf-8")
+        ).hexdigest()
+        return (self.model_name, digest)
 
-        MAX_RETRIES = 3
+    def build_payload(self, prompt_content: str, json_resp: str, max_tokens: int) -> dict:
+        """Chat completion payload with the output budget and, if supported, a JSON response format."""
+        messages = [{"role": "user", "content": prompt_content}]
+        payload = {"model": self.model_name, "messages": messages, "temperature": 0}
+        if max_tokens:
+            payload["max_tokens"] = int(min(max_tokens, self.model_max_output_tokens))
+        if self.streaming:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+
+        schema = None
+        if self.response_format_mode == "json_schema":
+            schema = json_schema_from_template(json_resp)
+        if schema is not None:
+            payload["response_format"] = {"type": "json_schema", "json_schema": schema}
+        elif self.response_format_mode in ("json_schema", "json_object") and not is_array_template(json_resp):
+            # json_object forces an object root, which would contradict an array template
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    async def _complete(self, client, payload, keys, prompt_tokens, early_abort=False):
+        """
+        Run one completion.
+
+        Returns (content, usage, early_response). With early_abort, early_response
+        is set when a streamed "updated": "NO" answer was cut off before its "code" field.
+        """
+        if not self.streaming:
+            response = await client.post(self.model_url, json=payload)
+            response.raise_for_status()
+            response_data = response.json()
+            return response_data["choices"][0]["message"]["content"], response_data.get("usage"), None
+
+        scanner = StreamingJsonScanner()
+        usage = None
+        early_response = None
+        async with client.stream("POST", self.model_url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        scanner.feed(delta)
+
+                # An unmodified object does not need its code echoed back
+                if (
+                    early_abort
+                    and self.stream_early_abort
+                    and str(scanner.fields.get("updated", "")).upper() == "NO"
+                    and "code" in scanner.started
+                ):
+                    early_response = {key: scanner.fields.get(key, "") for key in keys}
+                    early_response.update(scanner.fields)
+                    break
+
+        if usage is None:
+            # Aborted streams (and servers without include_usage) report no usage
+            completion_tokens = await self.count_tokens(scanner.text)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+        return scanner.text, usage, early_response
+
+    async def _complete_with_retry(self, client, payload, keys, prompt_tokens, max_tokens, ObjectID, deadline, early_abort=False):
+        """_complete() under the rate limiter, retrying transient failures per the RetryPolicy."""
+        retry = 0
+        while True:
+            # Reserve the prompt plus the whole output budget; settled against usage below
+            reservation = await self.rate_limiter.acquire(prompt_tokens + max_tokens)
+            used_tokens = prompt_tokens
+            try:
+                ai_content, usage, early_response = await self._complete(
+                    client, payload, keys, prompt_tokens, early_abort
+                )
+                if usage:
+                    used_tokens = usage.get("total_tokens", used_tokens)
+                return ai_content, usage, early_response
+            except httpx.HTTPError as e:
+                if isinstance(e, httpx.HTTPStatusError):
+                    used_tokens = 0  # Rejected calls are not billed
+                retry += 1
+                delay = self.retry_policy.next_delay(e, retry, deadline)
+                if delay is None:
+                    raise
+                print(f"[Retry {retry}] {e} for ObjectID-{ObjectID}; retrying in {delay:.1f}s")
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                    # Throttling applies to the whole deployment: slow every caller down
+                    await self.rate_limiter.penalize(delay)
+                else:
+                    await asyncio.sleep(delay)
+            finally:
+                await self.rate_limiter.reconcile(reservation, used_tokens)
+
+    @staticmethod
+    def _cache_entry_size(entry):
+        return len(json.dumps(entry))
+
+    async def ask_ai_model(self, prompt_content: str, json_resp: str, max_tokens: int, ObjectID=None, prompt_tokens=None, bypass_cache=False, early_abort=False):
+        """
+        Ask the model for a JSON answer shaped like json_resp.
+
+        early_abort lets a streamed "updated": "NO" answer stop before its code
+        (MODEL_STREAM_EARLY_ABORT); only callers that never read the code of an
+        unmodified answer should pass it. Early-aborted answers are not cached.
+        """
         tokens = {
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0
         }
 
-        messages = [{"role": "user", "content": prompt_content}]
-        payload = {"model": self.model_name, "messages": messages, "temperature": 0}
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache_key(prompt_content, json_resp)
+            if not (bypass_cache or bypass_response_cache.get()):
+                cached = await self.response_cache.lookup(cache_key, self._cache_entry_size)
+                if cached is not None:
+                    # Cache hits never reach the model, so they skip the rate limiter too
+                    saved = cached["tokens"]["total_tokens"]
+                    self.saved_tokens += saved
+                    await self.response_cache.increment(cache_key, {"hits": 1, "saved_tokens": saved})
+                    print(f"Processed ObjectID - {ObjectID} (cached response)")
+                    # A copy per caller: callers edit the answers they get
+                    return copy.deepcopy(cached["response"]), "success", tokens
+
+        ai_response, ai_msg, tokens, aborted = await self._ask_ai_model(
+            prompt_content, json_resp, max_tokens, ObjectID, prompt_tokens, tokens, early_abort
+        )
+        if cache_key is not None and ai_response is not None and not aborted:
+            await self.response_cache.store(
+                cache_key,
+                {"response": copy.deepcopy(ai_response), "tokens": tokens, "hits": 0, "saved_tokens": 0},
+                self._cache_entry_size,
+            )
+        return ai_response, ai_msg, tokens
+
+    async def _ask_ai_model(self, prompt_content, json_resp, max_tokens, ObjectID, prompt_tokens, tokens, early_abort=False):
+        """Returns (response, message, tokens, aborted); aborted marks a truncated early-abort answer."""
+        MAX_RETRIES = 3
+        keys = expected_keys(json_resp)
+        payload = self.build_payload(prompt_content, json_resp, max_tokens)
+
+        client = self.client or await self.open()
+        deadline = self.retry_policy.deadline()
+        for attempt in range(1, MAX_RETRIES + 1):
+            if prompt_tokens is None:
+                prompt_tokens = await self.count_tokens(prompt_content)
+            try:
+                ai_content, usage, early_response = await self._complete_with_retry(
+                    client, payload, keys, prompt_tokens, max_tokens, ObjectID, deadline, early_abort
+                )
 
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            for attempt in range(1, MAX_RETRIES + 1):
                 try:
-                    response = await client.post(self.model_url, headers=self.headers, json=payload)
-                    response.raise_for_status()
-
-                    response_data = response.json()
-                    ai_content = response_data["choices"][0]["message"]["content"]
-
-                    try:
-                        ai_response = json.loads(ai_content)
-
-                        tokens = {
-                            "prompt_tokens": response_data["usage"]["prompt_tokens"],
-                            "completion_tokens": response_data["usage"]["completion_tokens"],
-                            "total_tokens": response_data["usage"]["total_tokens"]
-                        }
-
-                        print(f"Processed ObjectID - {ObjectID}")
-                        return ai_response, "success", tokens
-
-                    except json.JSONDecodeError as e:
-                        print(f"[Attempt {attempt}] Failed to decode AI response JSON: {e}")
-                        if attempt < MAX_RETRIES:
-                            await asyncio.sleep(self.model_invocation_delay)
-                            prompt_content = (
-                                f"The following text is not a valid JSON string:\n```{ai_content}```\n"
-                                f"Error when parsing with json.loads():\n```{e}```\n"
-                                f"It should match this format:\n```{json_resp}```\n"
-                                f"Make sure your response is a valid JSON string. Respond only with the JSON."
-                            )
-                            messages = [{"role": "user", "content": prompt_content}]
-                            payload = {"model": self.model_name, "messages": messages, "temperature": 0}
-                        else:
-                            return None, "Max retries reached! Failed to obtain valid JSON from AI.", tokens
-
-                except httpx.HTTPError as e:
-                    print(f"[Attempt {attempt}] HTTP error for ObjectID-{ObjectID}: {e}")
-                    # await self.app_logger.log_error("ask_ai_model", e)
-                    return None, f"HTTP Error: {e}. Please retry.", tokens
-                except Exception as e:
-                    print(f"[Attempt {attempt}] Unexpected error for ObjectID-{ObjectID}: {e}")
-                    # await self.app_logger.log_error("ask_ai_model", e)
-                    return None, f"Unexpected Error: {e}. Please retry.", tokens
-
-        return None, "AI Model failed to fix the code. Please Resend the request...", tokens
+                    if early_response is not None:
+                        ai_response = early_response
+                        self.json_stats["early_abort"] += 1
+                    else:
+                        # Local repair first; only a failed repair costs a re-prompt
+                        ai_response, json_path = parse_json_response(ai_content, keys)
+                        self.json_stats[json_path] += 1
+
+                    tokens = {
+                        "prompt_tokens": usage["prompt_tokens"],
+                        "completion_tokens": usage["completion_tokens"],
+                        "total_tokens": usage["total_tokens"]
+                    }
+
+                    print(f"Processed ObjectID - {ObjectID}")
+                    return ai_response, "success", tokens, early_response is not None
+
+                except ValueError as e:
+                    print(f"[Attempt {attempt}] Failed to decode AI response JSON: {e}")
+                    if attempt < MAX_RETRIES:
+                        self.json_stats["reprompt"] += 1
+                        prompt_content = (
+                            f"The following text is not a valid JSON string:\n```{ai_content}```\n"
+                            f"Error when parsing with json.loads():\n```{e}```\n"
+                            f"It should match this format:\n```{json_resp}```\n"
+                            f"Make sure your response is a valid JSON string. Respond only with the JSON."
+                        )
+                        payload = self.build_payload(prompt_content, json_resp, max_tokens)
+                        prompt_tokens = None
+                    else:
+                        self.json_stats["failed"] += 1
+                        return None, "Max retries reached! Failed to obtain valid JSON from AI.", tokens, False
+
+            except httpx.HTTPError as e:
+                print(f"[Attempt {attempt}] HTTP error for ObjectID-{ObjectID}: {e}")
+                # await self.app_logger.log_error("ask_ai_model", e)
+                return None, f"HTTP Error: {e}. Please retry.", tokens, False
+            except Exception as e:
+                print(f"[Attempt {attempt}] Unexpected error for ObjectID-{ObjectID}: {e}")
+                # await self.app_logger.log_error("ask_ai_model", e)
+                return None, f"Unexpected Error: {e}. Please retry.", tokens, False
+
+        return None, "AI Model failed to fix the code. Please Resend the request...", tokens, False
@@ -1,18 +1,40 @@
 # app_logger_async.py
+import asyncio
 import traceback
+from datetime import datetime, timezone
 from utils import get_timestamp
 
 class AppLogger:
-    def __init__(self, mongo_db):
+    def __init__(self, mongo_db, event_writer=None):
         self.mongo_db = mongo_db
+        # When set, errors are batched by the AppEventWriter instead of inserted one by one
+        self.event_writer = event_writer
 
-    async def log_error(self, function_name, exception):
-        collection = self.mongo_db.get_collection("ExceptionLog")
-        error_data = {
+    def _error_data(self, function_name, exception):
+        return {
             "function": function_name,
             "error": str(exception),
             "trace": traceback.format_exc(),
             "timestamp": get_timestamp(),
+            "created_at": datetime.now(timezone.utc),
         }
-        await collection.insert_one(error_data)
+
+    async def log_error(self, function_name, exception):
+        error_data = self._error_data(function_name, exception)
+        if self.event_writer is not None:
+            await self.event_writer.write("ExceptionLog", error_data)
+        else:
+            collection = self.mongo_db.get_collection("ExceptionLog")
+            await collection.insert_one(error_data)
+        print(f"Error logged to MongoDB: {error_data}\n")
+
+    def log_error_nowait(self, function_name, exception):
+        """log_error for synchronous code: the error is buffered (or written in the background)."""
+        error_data = self._error_data(function_name, exception)
+        if self.event_writer is not None:
+            self.event_writer.emit("ExceptionLog", error_data)
+        else:
+            asyncio.get_running_loop().create_task(
+                self.mongo_db.get_collection("ExceptionLog").insert_one(error_data)
+            )
         print(f"Error logged to MongoDB: {error_data}\n")
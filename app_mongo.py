@@ -1,12 +1,46 @@
 # app_mongo_async.py
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from config import Config
 
+# Index for every hot query: (collection, keys, options). TTL indexes are added in ensure_indexes.
+INDEXES = [
+    # Claim query and ListPendingRequests
+    ("status_queue", [("status", ASCENDING), ("timestamp", ASCENDING)], {}),
+    # Publish upsert and RequestStatus
+    ("status_queue", [("request_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+    # Lease reaper
+    ("status_queue", [("status", ASCENDING), ("lease_expires", ASCENDING)], {}),
+    ("status_queue_dead_letter", [("request_id", ASCENDING)], {}),
+    ("EngineInput", [("request.requestid", ASCENDING)], {}),
+    ("PromptLibrary", [("issueid", ASCENDING)], {}),
+    ("EngineOutput", [("requestid", ASCENDING)], {}),
+    ("FilesContent", [("requestid", ASCENDING)], {}),
+]
+
+# Hot queries whose plans are checked at startup: (collection, filter, sort)
+HOT_QUERIES = [
+    ("status_queue", {"status": "queued"}, [("timestamp", ASCENDING)]),
+    ("status_queue", {"request_id": ""}, [("timestamp", DESCENDING)]),
+    ("EngineInput", {"request.requestid": ""}, None),
+    ("PromptLibrary", {"issueid": 0}, None),
+    ("EngineOutput", {"requestid": ""}, None),
+    ("FilesContent", {"requestid": ""}, None),
+]
+
 class AppMongoDb:
     def __init__(self, config:Config):
         self.connection_string = config.MONGODB_CONNECTION_STRING
         self.mongodb_name = config.MONGODB_NAME
         self.client = AsyncIOMotorClient(self.connection_string)
+        self.ensure_indexes_enabled = config.MONGODB_ENSURE_INDEXES
+        self.check_query_plans_enabled = config.MONGODB_CHECK_QUERY_PLANS
+        # audit_log and ExceptionLog expire on their created_at date
+        self.log_ttls = {
+            "audit_log": config.AUDIT_LOG_TTL_DAYS * 86400,
+            "ExceptionLog": config.EXCEPTION_LOG_TTL_DAYS * 86400,
+        }
 
     def get_collection(self, collection_name):
         db = self.client[self.mongodb_name]
@@ -15,3 +49,69 @@ class AppMongoDb:
     async def list_collections(self):
         db = self.client[self.mongodb_name]
         return await db.list_collection_names()
+
+    async def startup(self):
+        """Create the indexes and check the hot query plans, as configured."""
+        if self.ensure_indexes_enabled:
+            await self.ensure_indexes()
+        if self.check_query_plans_enabled:
+            await self.check_query_plans()
+
+    async def ensure_indexes(self):
+        """Create every index the engine relies on; safe to run on every start."""
+        db = self.client[self.mongodb_name]
+        for collection_name, keys, options in INDEXES:
+            try:
+                await db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                print(f"[AppMongoDb] Failed to create index {keys} on {collection_name}: {e}")
+
+        for collection_name, seconds in self.log_ttls.items():
+            try:
+                await db[collection_name].create_index(
+                    "created_at", name="created_at_ttl", expireAfterSeconds=seconds
+                )
+            except OperationFailure as e:
+                if e.code not in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+                    print(f"[AppMongoDb] Failed to create TTL index on {collection_name}: {e}")
+                    continue
+                # The retention changed: update the existing TTL index in place
+                try:
+                    await db.command(
+                        "collMod",
+                        collection_name,
+                        index={"name": "created_at_ttl", "expireAfterSeconds": seconds},
+                    )
+                except OperationFailure as e:
+                    print(f"[AppMongoDb] Failed to update TTL index on {collection_name}: {e}")
+        print("[AppMongoDb] Indexes ensured.")
+
+    async def check_query_plans(self):
+        """Warn about hot queries that would scan a whole collection. Returns the warnings."""
+        db = self.client[self.mongodb_name]
+        warnings = []
+        for collection_name, query, sort in HOT_QUERIES:
+            try:
+                cursor = db[collection_name].find(query)
+                if sort:
+                    cursor = cursor.sort(sort)
+                plan = await cursor.explain()
+            except OperationFailure as e:
+                print(f"[AppMongoDb] Failed to explain query on {collection_name}: {e}")
+                continue
+            if _has_stage(plan.get("queryPlanner", {}).get("winningPlan", {}), "COLLSCAN"):
+                warning = f"COLLSCAN on {collection_name} for {query} sort {sort}"
+                warnings.append(warning)
+                print(f"[AppMongoDb] WARNING: {warning}")
+        return warnings
+
+
+def _has_stage(plan, stage):
+    """Whether a query plan (or any of its input stages) uses the given stage."""
+    if plan.get("stage") == stage:
+        return True
+    children = plan.get("inputStages", [])
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            children = children + [plan[key]]
+    return any(_has_stage(child, stage) for child in children)
@@ -1,6 +1,6 @@
 # app_mq.py
 from app_mq_rabbitmq import RabbitMQ
-# from app_mq_kafka import KafkaMQ
+from app_mq_kafka import KafkaMQ
 from app_mq_mongodb import MongoDBMQ  # Using async MongoDB queue (Motor)
 from config import Config
 
@@ -23,8 +23,8 @@ class AppMessageQueue:
         """
         if self.vendor == 'rabbitmq':
             return RabbitMQ(self.config)
-        # elif self.vendor == 'kafka':
-        #     return KafkaMQ(self.config)
+        elif self.vendor == 'kafka':
+            return KafkaMQ(self.config)
         elif self.vendor == 'mongodb':
             return MongoDBMQ(self.config)
         else:
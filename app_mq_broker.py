@@ -0,0 +1,94 @@
+# app_mq_broker.py
+from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import json
+import time
+
+class BrokerMQ():
+    """
+    Base of the broker-backed job queues (RabbitMQ, Kafka).
+
+    Messages are JSON dicts shaped like MongoDBMQ documents, and `db` is the
+    MongoDB status store read by RequestStatus and ListPendingRequests.
+    Subclasses start a consumer feeding a local queue of deliveries
+    (_start_consumer), turn a delivery into a job (_delivered), and implement
+    publish, ack, nack and close.
+    """
+
+    name = "BrokerMQ"
+
+    def __init__(self, config):
+        self.config = config
+        self.client = AsyncIOMotorClient(config.MONGODB_CONNECTION_STRING)
+        self.db = self.client[config.MONGODB_NAME]
+        self.deliveries = {}  # topic -> asyncio.Queue of incoming deliveries
+        self.consumer_starts = {}  # topic -> task starting its consumer
+
+    @staticmethod
+    def _decode(body):
+        body = body.decode("utf-8")
+        try:
+            doc = json.loads(body)
+        except ValueError:
+            doc = None
+        if not isinstance(doc, dict):
+            # Older producers published the bare request id
+            doc = {"request_id": body.strip().strip('"'), "retry_count": 0}
+        return doc
+
+    async def set_status(self, topic, message):
+        """Record a request status without enqueueing anything."""
+        try:
+            request_id = message.get("request_id")
+            message["timestamp"] = time.time()
+            await self.db[topic].update_one(
+                {"request_id": request_id},
+                {"$set": message},
+                upsert=True
+            )
+            return request_id
+        except Exception as e:
+            print(f"[{self.name}] Status update error: {e}")
+            return None
+
+    async def get_latest_status(self, topic, request_id):
+        doc = await self.db[topic].find_one({"request_id": request_id}, sort=[("timestamp", -1)])
+        return doc["status"] if doc else None
+
+    async def _consumer_started(self, topic):
+        """Start the topic's consumer once; concurrent callers share the attempt, a failed one is retried."""
+        start = self.consumer_starts.get(topic)
+        if start is None or (start.done() and (start.cancelled() or start.exception())):
+            self.deliveries[topic] = asyncio.Queue()
+            start = asyncio.create_task(self._start_consumer(topic, self.deliveries[topic]))
+            self.consumer_starts[topic] = start
+        await asyncio.shield(start)
+
+    async def get(self, topic, timeout=5):
+        """Wait up to `timeout` seconds for a job; ack() or nack() it when done."""
+        await self._consumer_started(topic)
+        try:
+            delivery = await asyncio.wait_for(self.deliveries[topic].get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        doc = self._delivered(topic, delivery)
+        await self.set_status(topic, {
+            "request_id": doc.get("request_id"),
+            "status": "processing",
+            "processing_start": time.time()
+        })
+        return doc
+
+    async def process(self, topic, callback):
+        """Run callback(doc) for every job on topic, acking each one after the callback."""
+        while True:
+            doc = await self.get(topic, timeout=3600)
+            if doc is None:
+                continue
+            try:
+                await callback(doc)
+                await self.ack(topic, doc)
+            except Exception as e:
+                print(f"[!] Error processing message: {e}")
+                await self.nack(topic, doc)
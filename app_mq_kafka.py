@@ -1,58 +1,202 @@
-# from base_mq import BaseMQ
-# from kafka import KafkaProducer, KafkaConsumer
-# from flask import Config as FlaskConfig
-# import json, threading
-
-# class KafkaMQ(BaseMQ):
-#     def __init__(self, config: FlaskConfig):
-#         self.config = config
-#         self._lock = threading.Lock()
-#         self.producer = KafkaProducer(
-#             bootstrap_servers=config["KAFKA_BOOTSTRAP_SERVERS"],
-#             value_serializer=lambda v: json.dumps(v).encode("utf-8")
-#         )
-#         self.consumers = []
-
-#     def close(self):
-#         with self._lock:
-#             self.producer.close()
-#         for consumer in self.consumers:
-#             consumer.close()
-
-#     def publish(self, topic, message):
-#         with self._lock:
-#             self.producer.send(topic, message)
-#             self.producer.flush()
-
-#     def process(self, topic, callback):
-#         def run():
-#             consumer = KafkaConsumer(
-#                 topic,
-#                 bootstrap_servers=self.config["KAFKA_BOOTSTRAP_SERVERS"],
-#                 group_id=self.config["KAFKA_GROUP_ID"],
-#                 enable_auto_commit=True,
-#                 session_timeout_ms=10000,
-#                 heartbeat_interval_ms=3000,
-#                 max_poll_interval_ms=300000,
-#                 auto_offset_reset=self.config["KAFKA_AUTO_OFFSET_RESET"],
-#                 value_deserializer=lambda m: json.loads(m.decode("utf-8"))
-#             )
-#             self.consumers.append(consumer)
-#             for msg in consumer:
-#                 callback(msg.value)
-
-#         thread = threading.Thread(target=run, daemon=True)
-#         thread.start()
-
-#     def get(self, topic):
-#         consumer = KafkaConsumer(
-#             topic,
-#             bootstrap_servers=self.config["KAFKA_BOOTSTRAP_SERVERS"],
-#             group_id=None,
-#             auto_offset_reset=self.config["KAFKA_AUTO_OFFSET_RESET"],
-#             consumer_timeout_ms=1000,
-#             value_deserializer=lambda m: json.loads(m.decode("utf-8"))
-#         )
-#         for msg in consumer:
-#             return msg.value
-#         return None
+# app_mq_kafka.py
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, ConsumerRebalanceListener, TopicPartition
+from aiokafka.errors import CommitFailedError, KafkaError
+from app_mq_broker import BrokerMQ
+import asyncio
+import json
+import time
+
+class KafkaMQ(BrokerMQ):
+    """
+    Kafka job queue (aiokafka) with request statuses kept in MongoDB.
+
+    - Messages are keyed by applicationid, so every request of an application
+      lands on the same partition and on the worker whose caches are warm for it.
+    - Workers scale through the consumer group KAFKA_GROUP_ID; each process
+      holds at most KAFKA_PREFETCH (default MAX_THREADS) uncompleted jobs.
+    - Offsets are committed manually: ack() marks a job done and commits the
+      partition up to its oldest job still in flight, so a crash replays
+      unfinished jobs (at-least-once).
+    """
+
+    name = "KafkaMQ"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.bootstrap_servers = config.KAFKA_BOOTSTRAP_SERVERS
+        self.group_id = config.KAFKA_GROUP_ID or "cast-code-fix-engine"
+        self.auto_offset_reset = config.KAFKA_AUTO_OFFSET_RESET or "earliest"
+        self.prefetch = config.KAFKA_PREFETCH or config.MAX_THREADS
+
+        self.producer = None
+        self.producer_lock = asyncio.Lock()
+        self.consumers = {}  # topic -> AIOKafkaConsumer
+        self.fetchers = {}  # topic -> fetch task
+        self.inflight = {}  # TopicPartition -> offsets delivered but not acked
+        self.next_offset = {}  # TopicPartition -> offset after the last delivered one
+        self.committed = {}  # TopicPartition -> last committed offset
+
+    async def _producer(self):
+        async with self.producer_lock:
+            if self.producer is None:
+                producer = AIOKafkaProducer(
+                    bootstrap_servers=self.bootstrap_servers,
+                    key_serializer=lambda k: str(k).encode("utf-8"),
+                    value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+                    acks="all",
+                    linger_ms=5,
+                )
+                await producer.start()
+                self.producer = producer
+        return self.producer
+
+    async def close(self):
+        for topic, task in self.fetchers.items():
+            task.cancel()
+        await asyncio.gather(*self.fetchers.values(), return_exceptions=True)
+        for consumer in self.consumers.values():
+            await consumer.stop()
+        if self.producer:
+            await self.producer.stop()
+        self.client.close()
+
+    async def _application_id(self, request_id):
+        """The application of a request, read from its EngineInput document."""
+        doc = await self.db["EngineInput"].find_one(
+            {"request.requestid": f"{request_id}"}, {"request.requestid": 1, "request.applicationid": 1}
+        )
+        for request in (doc or {}).get("request", []):
+            if request.get("requestid") == request_id:
+                return request.get("applicationid")
+        return None
+
+    async def publish(self, topic, message):
+        """Record the job as queued, then enqueue it keyed by its application."""
+        try:
+            request_id = message.get("request_id")
+            if not message.get("applicationid"):
+                message["applicationid"] = await self._application_id(request_id)
+            await self.set_status(topic, dict(message))
+            message["timestamp"] = time.time()
+
+            producer = await self._producer()
+            await producer.send_and_wait(
+                topic, message, key=message["applicationid"] or request_id
+            )
+            return request_id
+        except Exception as e:
+            print(f"[KafkaMQ] Publish error: {e}")
+            return None
+
+    async def _start_consumer(self, topic, deliveries):
+        consumer = AIOKafkaConsumer(
+            bootstrap_servers=self.bootstrap_servers,
+            group_id=self.group_id,
+            enable_auto_commit=False,
+            auto_offset_reset=self.auto_offset_reset,
+            value_deserializer=self._decode,
+        )
+        consumer.subscribe([topic], listener=_Rebalance(self, topic))
+        try:
+            await consumer.start()
+        except Exception:
+            # The next get() retries with a new consumer
+            await consumer.stop()
+            raise
+        self.consumers[topic] = consumer
+        self.fetchers[topic] = asyncio.create_task(self._fetch(topic))
+
+    async def _fetch(self, topic):
+        """Fetch jobs into the local queue, pausing partitions while the prefetch is full."""
+        consumer = self.consumers[topic]
+        deliveries = self.deliveries[topic]
+        while True:
+            try:
+                # Keep polling while paused so the group does not consider us dead
+                uncompleted = sum(len(offsets) for offsets in self.inflight.values())
+                if uncompleted >= self.prefetch:
+                    consumer.pause(*consumer.assignment())
+                else:
+                    consumer.resume(*consumer.paused())
+                batches = await consumer.getmany(
+                    timeout_ms=1000, max_records=max(self.prefetch - uncompleted, 1)
+                )
+                for tp, records in batches.items():
+                    for record in records:
+                        doc = record.value
+                        doc["_partition"] = tp.partition
+                        doc["_offset"] = record.offset
+                        self.inflight.setdefault(tp, set()).add(record.offset)
+                        self.next_offset[tp] = record.offset + 1
+                        deliveries.put_nowait(doc)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[KafkaMQ] Fetch error on {topic}: {e}")
+                await asyncio.sleep(1)
+
+    def _delivered(self, topic, doc):
+        return doc  # decoded by the consumer's value_deserializer
+
+    async def ack(self, topic, doc):
+        """Mark a job done and commit its partition up to the oldest job still in flight."""
+        tp = TopicPartition(topic, doc["_partition"])
+        inflight = self.inflight.get(tp)
+        if inflight is None:
+            return  # the partition was revoked meanwhile
+        inflight.discard(doc["_offset"])
+        await self._commit(topic, [tp])
+
+    async def nack(self, topic, doc):
+        """Requeue a failed job at the end of its partition, then let its offset be committed."""
+        job = {key: value for key, value in doc.items() if not key.startswith("_")}
+        job["status"] = "queued"
+        await self.publish(topic, job)
+        await self.ack(topic, doc)
+
+    async def _commit(self, topic, partitions):
+        offsets = {}
+        for tp in partitions:
+            inflight = self.inflight.get(tp)
+            if inflight is None or tp not in self.next_offset:
+                continue
+            offset = min(inflight) if inflight else self.next_offset[tp]
+            if offset > self.committed.get(tp, -1):
+                offsets[tp] = offset
+        if not offsets:
+            return
+        try:
+            await self.consumers[topic].commit(offsets)
+            self.committed.update(offsets)
+        except (CommitFailedError, KafkaError) as e:
+            # Rebalanced away: the new owner replays from its last commit
+            print(f"[KafkaMQ] Commit error on {topic}: {e}")
+
+    def _forget(self, partitions):
+        for tp in partitions:
+            self.inflight.pop(tp, None)
+            self.next_offset.pop(tp, None)
+            self.committed.pop(tp, None)
+
+
+class _Rebalance(ConsumerRebalanceListener):
+    def __init__(self, mq, topic):
+        self.mq = mq
+        self.topic = topic
+
+    async def on_partitions_revoked(self, revoked):
+        # Commit what is done before another member takes the partitions over
+        await self.mq._commit(self.topic, revoked)
+        self.mq._forget(revoked)
+        # Jobs not handed to a worker yet will be redelivered to the new owner
+        deliveries = self.mq.deliveries[self.topic]
+        kept = []
+        while not deliveries.empty():
+            doc = deliveries.get_nowait()
+            if TopicPartition(self.topic, doc["_partition"]) not in revoked:
+                kept.append(doc)
+        for doc in kept:
+            deliveries.put_nowait(doc)
+
+    async def on_partitions_assigned(self, assigned):
+        pass
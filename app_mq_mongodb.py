@@ -1,14 +1,49 @@
 # app_mq_mongodb.py
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure, PyMongoError
 import asyncio
+import os
+import socket
 import time
+import uuid
+import weakref
 from config import Config
 
 class MongoDBMQ():
+    """
+    Queue on MongoDB documents, one per request_id.
+
+    get() claims a queued document with a lease owned by this worker; the
+    worker renews it with renew() while the job runs. Expired leases (the
+    worker died) are re-queued with retry_count + 1 by reap(); a job over
+    MQ_MAX_RETRIES is marked "dead" and copied to <topic>_dead_letter.
+
+    With MQ_CONSUMER_MODE "change_stream", idle claimers wait on a change
+    stream for queued documents instead of polling. Without a replica set
+    (or while the stream is down) they poll with exponential idle backoff
+    between MQ_POLL_MIN_INTERVAL and MQ_POLL_MAX_INTERVAL seconds.
+    """
+
     def __init__(self, config: Config):
         self.config = config
         self.client = AsyncIOMotorClient(config.MONGODB_CONNECTION_STRING)
         self.db = self.client[config.MONGODB_NAME]
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = config.MQ_LEASE_SECONDS
+        self.heartbeat_seconds = config.MQ_HEARTBEAT_SECONDS
+        self.max_retries = config.MQ_MAX_RETRIES
+        self.reaper_interval = config.MQ_REAPER_INTERVAL_SECONDS
+        self.last_reap = 0.0
+
+        self.consumer_mode = config.MQ_CONSUMER_MODE
+        self.poll_min_interval = config.MQ_POLL_MIN_INTERVAL
+        self.poll_max_interval = config.MQ_POLL_MAX_INTERVAL
+        # Caller task -> {topic: current idle polling interval}; per caller, so
+        # several workers sharing this queue do not compound each other's backoff
+        self.poll_intervals = weakref.WeakKeyDictionary()
+        self.watchers = {}  # topic -> change stream task
+        self.wakeups = {}  # topic -> event set when a job is queued
+        self.streaming = {}  # topic -> change stream currently open
 
     async def publish(self, topic, message):
         try:
@@ -27,21 +62,152 @@ class MongoDBMQ():
             return None
 
     async def get(self, topic, timeout=5):
+        if self.consumer_mode == "change_stream" and topic not in self.watchers:
+            self.wakeups[topic] = asyncio.Event()
+            self.watchers[topic] = asyncio.create_task(self.watch(topic))
+
+        intervals = self.poll_intervals.setdefault(asyncio.current_task(), {})
         deadline = time.time() + timeout
         while time.time() < deadline:
+            if time.time() - self.last_reap >= self.reaper_interval:
+                self.last_reap = time.time()
+                await self.reap(topic)
+
+            # Taken before the claim so a job queued in between still wakes us
+            wakeup = self.wakeups.get(topic)
+            now = time.time()
             doc = await self.db[topic].find_one_and_update(
                 {"status": "queued"},
-                {"$set": {"status": "processing", "processing_start": time.time()}},
+                {"$set": {
+                    "status": "processing",
+                    "processing_start": now,
+                    "worker_id": self.worker_id,
+                    "lease_expires": now + self.lease_seconds
+                }},
                 sort=[("timestamp", 1)]
             )
             if doc:
+                intervals[topic] = self.poll_min_interval
                 return doc
-            await asyncio.sleep(0.5)
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if self.streaming.get(topic):
+                wait = remaining
+            else:
+                interval = intervals.get(topic, self.poll_min_interval)
+                intervals[topic] = min(interval * 2, self.poll_max_interval)
+                wait = min(interval, remaining)
+            if wakeup is not None:
+                # Also woken when the change stream opens
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(wait)
         return None
 
+    async def watch(self, topic):
+        """Wake idle claimers whenever a document of the topic becomes queued."""
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace"]}, "fullDocument.status": "queued"},
+            {"operationType": "update", "updateDescription.updatedFields.status": "queued"}
+        ]}}]
+        while True:
+            try:
+                async with self.db[topic].watch(pipeline) as stream:
+                    self.streaming[topic] = True
+                    # Jobs queued before the stream opened are picked up by the next claim
+                    self._wake(topic)
+                    async for _ in stream:
+                        self._wake(topic)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.streaming[topic] = False
+                if e.code == 40573:  # change streams need a replica set or sharded cluster
+                    print(f"[MongoDBMQ] Change streams unavailable ({e}); polling {topic}.")
+                    return
+                print(f"[MongoDBMQ] Change stream error on {topic}: {e}")
+            except PyMongoError as e:
+                self.streaming[topic] = False
+                print(f"[MongoDBMQ] Change stream error on {topic}: {e}")
+            self._wake(topic)
+            await asyncio.sleep(self.poll_max_interval)
+
+    def _wake(self, topic):
+        # Wake every waiter once; later waiters wait on a fresh event
+        self.wakeups[topic].set()
+        self.wakeups[topic] = asyncio.Event()
+
+    async def set_status(self, topic, message):
+        """Record a request status; for this backend the status document is the queue entry."""
+        return await self.publish(topic, message)
+
+    async def ack(self, topic, doc):
+        # Completion is recorded by set_status; nothing else to acknowledge
+        pass
+
+    async def nack(self, topic, doc):
+        # Left "processing": the reaper re-queues the job once its lease expires
+        pass
+
+    async def renew(self, topic, request_id):
+        """Extend this worker's lease on a job; False if the lease was lost to the reaper."""
+        try:
+            result = await self.db[topic].update_one(
+                {"request_id": request_id, "status": "processing", "worker_id": self.worker_id},
+                {"$set": {"lease_expires": time.time() + self.lease_seconds}}
+            )
+            return result.matched_count == 1
+        except Exception as e:
+            print(f"[MongoDBMQ] Lease renewal error: {e}")
+            return True
+
+    async def reap(self, topic):
+        """Re-queue jobs whose lease expired; dead-letter those over the retry limit."""
+        now = time.time()
+        try:
+            expired = self.db[topic].find({
+                "status": "processing",
+                "$or": [
+                    {"lease_expires": {"$lt": now}},
+                    # Claimed before leases existed
+                    {"lease_expires": {"$exists": False}, "processing_start": {"$lt": now - self.lease_seconds}}
+                ]
+            })
+            async for doc in expired:
+                retry_count = doc.get("retry_count", 0) + 1
+                # Matching the lease seen above makes concurrent reapers handle each job once
+                claim = {"_id": doc["_id"], "status": "processing", "lease_expires": doc.get("lease_expires")}
+                if retry_count > self.max_retries:
+                    result = await self.db[topic].update_one(claim, {
+                        "$set": {"status": "dead", "retry_count": retry_count, "timestamp": now},
+                        "$unset": {"worker_id": "", "lease_expires": ""}
+                    })
+                    if result.modified_count:
+                        dead = {key: value for key, value in doc.items() if key != "_id"}
+                        dead.update({"retry_count": retry_count, "dead_lettered_at": now})
+                        await self.db[f"{topic}_dead_letter"].insert_one(dead)
+                        print(f"[MongoDBMQ] {doc['request_id']} dead-lettered after {retry_count - 1} retries")
+                else:
+                    result = await self.db[topic].update_one(claim, {
+                        "$set": {"status": "queued", "retry_count": retry_count, "timestamp": now},
+                        "$unset": {"worker_id": "", "lease_expires": ""}
+                    })
+                    if result.modified_count:
+                        print(f"[MongoDBMQ] {doc['request_id']} lease expired; re-queued (retry {retry_count})")
+        except Exception as e:
+            print(f"[MongoDBMQ] Reaper error: {e}")
+
     async def get_latest_status(self, topic, request_id):
         doc = await self.db[topic].find_one({"request_id": request_id}, sort=[("timestamp", -1)])
         return doc["status"] if doc else None
 
     async def close(self):
+        for task in self.watchers.values():
+            task.cancel()
+        await asyncio.gather(*self.watchers.values(), return_exceptions=True)
         self.client.close()
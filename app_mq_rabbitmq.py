@@ -1,63 +1,178 @@
 # rabbitmq_async.py
 from aio_pika import connect_robust, Message, DeliveryMode
+from app_mq_broker import BrokerMQ
 import asyncio
 import json
+import time
+
+class RabbitMQ(BrokerMQ):
+    """
+    RabbitMQ job queue with request statuses kept in MongoDB.
+
+    - One robust connection; queues are declared once and cached.
+    - Publishing goes through a pool of confirming channels, and concurrent
+      publishes are confirmed together in batches of RABBITMQ_CONFIRM_BATCH_SIZE.
+    - get() is served by a push consumer whose prefetch matches the number of
+      queue workers; a message is acked (ack) only once its job is done, so an
+      unfinished job is redelivered if the worker dies.
+    """
+
+    name = "RabbitMQ"
 
-class RabbitMQ():
     def __init__(self, config):
-        self.config = config
+        super().__init__(config)
         self.url = (
-            f"amqp://{config['RABBITMQ_USER']}:{config['RABBITMQ_PASSWORD']}"
-            f"@{config['RABBITMQ_HOST']}:{config['RABBITMQ_PORT']}{config['RABBITMQ_VHOST']}"
+            f"amqp://{config.RABBITMQ_USER}:{config.RABBITMQ_PASSWORD}"
+            f"@{config.RABBITMQ_HOST}:{config.RABBITMQ_PORT}{config.RABBITMQ_VHOST}"
         )
+        self.prefetch = config.RABBITMQ_PREFETCH or config.MAX_THREADS
+        self.channel_pool_size = config.RABBITMQ_CHANNEL_POOL_SIZE
+        self.confirm_batch_size = config.RABBITMQ_CONFIRM_BATCH_SIZE
+
         self.connection = None
-        self.channel = None
+        self.channel = None  # consumer channel
+        self.connect_lock = asyncio.Lock()
+        self.queues = {}  # topic -> declared queue
+        self.publish_channels = None  # pool of confirming channels
+        self.pending_publishes = []  # (topic, body, future) waiting for a confirm batch
+        self.publish_wakeup = asyncio.Event()
+        self.publisher = None
+        self.confirm_tasks = set()  # running _confirm_batch tasks
+        self.consumers = {}  # topic -> consumer tag
+        self.unacked = {}  # delivery tag -> message
 
     async def connect(self):
-        self.connection = await connect_robust(self.url)
-        self.channel = await self.connection.channel()
+        async with self.connect_lock:
+            if self.connection:
+                return
+            self.connection = await connect_robust(self.url)
+            self.channel = await self.connection.channel()
+            await self.channel.set_qos(prefetch_count=self.prefetch)
+            self.publish_channels = asyncio.Queue()
+            for _ in range(self.channel_pool_size):
+                self.publish_channels.put_nowait(
+                    await self.connection.channel(publisher_confirms=True)
+                )
+            self.publisher = asyncio.create_task(self._publish_batches())
 
     async def close(self):
+        if self.publisher:
+            self.publisher.cancel()
+            await asyncio.gather(self.publisher, return_exceptions=True)
+        for task in self.confirm_tasks:
+            task.cancel()
+        await asyncio.gather(*self.confirm_tasks, return_exceptions=True)
+        # Publishes that never reached a channel fail instead of waiting forever
+        self._fail_publishes(self.pending_publishes, ConnectionError("RabbitMQ connection closed"))
+        self.pending_publishes = []
+        for topic, consumer_tag in self.consumers.items():
+            try:
+                await self.queues[topic].cancel(consumer_tag)
+            except Exception as e:
+                print(f"[RabbitMQ] Failed to cancel consumer on {topic}: {e}")
+        if self.publish_channels:
+            while not self.publish_channels.empty():
+                await self.publish_channels.get_nowait().close()
         if self.channel:
             await self.channel.close()
         if self.connection:
             await self.connection.close()
+        self.client.close()
+
+    async def _queue(self, topic):
+        if topic not in self.queues:
+            if not self.connection:
+                await self.connect()
+            self.queues[topic] = await self.channel.declare_queue(topic, durable=True)
+        return self.queues[topic]
 
     async def publish(self, topic, message):
-        if not self.channel:
-            await self.connect()
-
-        await self.channel.declare_queue(topic, durable=True)
-        body = message.encode() if isinstance(message, str) else json.dumps(message).encode()
-        await self.channel.default_exchange.publish(
-            Message(
-                body=body,
-                delivery_mode=DeliveryMode.PERSISTENT
-            ),
-            routing_key=topic
-        )
+        """Enqueue a job and record it as queued; returns once the broker confirmed it."""
+        await self._queue(topic)
+        request_id = message.get("request_id")
+        # Recorded first, so a fast consumer's "processing" status is not overwritten
+        await self.set_status(topic, dict(message))
+        message["timestamp"] = time.time()
+        body = json.dumps(message).encode()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending_publishes.append((topic, body, future))
+        self.publish_wakeup.set()
+        await future
+        return request_id
+
+    async def _publish_batches(self):
+        """Publish waiting messages on a pooled channel and await their confirms together."""
+        while True:
+            await self.publish_wakeup.wait()
+            self.publish_wakeup.clear()
+            while self.pending_publishes:
+                batch = self.pending_publishes[:self.confirm_batch_size]
+                del self.pending_publishes[:self.confirm_batch_size]
+                channel = await self.publish_channels.get()
+                task = asyncio.create_task(self._confirm_batch(channel, batch))
+                self.confirm_tasks.add(task)
+                task.add_done_callback(self.confirm_tasks.discard)
+
+    async def _confirm_batch(self, channel, batch):
+        try:
+            results = await asyncio.gather(
+                *[
+                    channel.default_exchange.publish(
+                        Message(body=body, delivery_mode=DeliveryMode.PERSISTENT),
+                        routing_key=topic
+                    )
+                    for topic, body, _ in batch
+                ],
+                return_exceptions=True
+            )
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(None)
+        except asyncio.CancelledError:
+            # Cancelled by close(): never leave publish() hanging
+            self._fail_publishes(batch, ConnectionError("RabbitMQ connection closed"))
+            raise
+        except Exception as e:
+            print(f"[RabbitMQ] Confirm batch error: {e}")
+            self._fail_publishes(batch, e)
+        finally:
+            self.publish_channels.put_nowait(channel)
+
+    @staticmethod
+    def _fail_publishes(batch, error):
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _start_consumer(self, topic, deliveries):
+        queue = await self._queue(topic)
+        self.consumers[topic] = await queue.consume(deliveries.put)
+
+    def _delivered(self, topic, message):
+        doc = self._decode(message.body)
+        doc["_delivery_tag"] = message.delivery_tag
+        self.unacked[message.delivery_tag] = message
+        return doc
+
+    async def ack(self, topic, doc):
+        message = self.unacked.pop(doc.get("_delivery_tag"), None)
+        if message:
+            try:
+                await message.ack()
+            except Exception as e:
+                # e.g. the channel was reconnected: the broker redelivers the job
+                print(f"[RabbitMQ] Ack error: {e}")
 
-    async def get(self, topic, timeout=5):
-        if not self.channel:
-            await self.connect()
-
-        queue = await self.channel.declare_queue(topic, durable=True)
-        incoming_message = await queue.get(timeout=timeout, fail=False)
-        if incoming_message:
-            async with incoming_message.process():
-                return incoming_message.body.decode()
-        return None
-
-    async def process(self, topic, callback):
-        if not self.channel:
-            await self.connect()
-
-        queue = await self.channel.declare_queue(topic, durable=True)
-
-        async with queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                async with message.process():
-                    try:
-                        await callback(message.body.decode())
-                    except Exception as e:
-                        print(f"[!] Error processing message: {e}")
+    async def nack(self, topic, doc):
+        """Give a job back to the queue for redelivery."""
+        message = self.unacked.pop(doc.get("_delivery_tag"), None)
+        if message:
+            try:
+                await message.nack(requeue=True)
+            except Exception as e:
+                print(f"[RabbitMQ] Nack error: {e}")
@@ -0,0 +1,169 @@
+# app_rate_limiter.py
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import Config
+
+
+class AppRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter for model calls.
+
+    Callers reserve their estimated tokens before a call with acquire() and
+    settle the difference with reconcile() once the API reports usage.
+
+    Modes:
+        "local":   token buckets shared by every coroutine of this process.
+        "mongodb": one-minute windows counted in the RateLimiter collection,
+                   shared by every worker process using the same database.
+    """
+
+    def __init__(self, config: Config, mongo_db=None):
+        self.name = config.MODEL_NAME
+        self.rpm = config.MODEL_REQUESTS_PER_MINUTE
+        self.tpm = config.MODEL_TOKENS_PER_MINUTE
+        self.mode = config.MODEL_RATE_LIMITER
+        if self.mode == "mongodb" and mongo_db is None:
+            raise ValueError("MODEL_RATE_LIMITER 'mongodb' requires a MongoDB connection")
+        self.collection = mongo_db.get_collection("RateLimiter") if mongo_db is not None else None
+        self.ttl_index_ready = False
+
+        # Local token buckets, refilled continuously
+        self.request_allowance = float(self.rpm)
+        self.token_allowance = float(self.tpm)
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+        # Set after a 429 so every caller backs off, not just the one that was throttled
+        self.blocked_until = 0.0
+
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.penalties = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.request_allowance = min(self.rpm, self.request_allowance + elapsed * self.rpm / 60.0)
+        self.token_allowance = min(self.tpm, self.token_allowance + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens: int) -> dict:
+        """Wait until one request and `tokens` tokens fit in the budget, then reserve them."""
+        tokens = min(max(int(tokens), 0), self.tpm)
+        started = time.monotonic()
+        await self._wait_if_blocked()
+        if self.mode == "mongodb":
+            reservation = await self._acquire_mongodb(tokens)
+        else:
+            reservation = await self._acquire_local(tokens)
+        self.acquired += 1
+        self.waited_seconds += time.monotonic() - started
+        return reservation
+
+    async def reconcile(self, reservation: dict, actual_tokens: int):
+        """Return unused reserved tokens to the budget, or charge the overrun."""
+        delta = reservation["tokens"] - int(actual_tokens)
+        if delta == 0:
+            return
+        if self.mode == "mongodb":
+            try:
+                await self.collection.update_one(
+                    {"_id": reservation["window"]}, {"$inc": {"tokens": -delta}}
+                )
+            except Exception as e:
+                print(f"[AppRateLimiter] Failed to reconcile tokens: {e}")
+        else:
+            # No await in between, so no lock is needed (and waiters holding it are not blocked)
+            self._refill()
+            self.token_allowance = min(self.tpm, self.token_allowance + delta)
+
+    async def penalize(self, delay: float):
+        """Pause every caller sharing this limiter for `delay` seconds (e.g. after a 429)."""
+        blocked_until = time.time() + delay
+        self.blocked_until = max(self.blocked_until, blocked_until)
+        self.penalties += 1
+        if self.mode == "mongodb":
+            try:
+                await self.collection.update_one(
+                    {"_id": f"{self.name}:blocked"},
+                    {
+                        "$max": {"blocked_until": blocked_until},
+                        "$set": {"expire_at": datetime.now(timezone.utc) + timedelta(seconds=delay + 60)},
+                    },
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"[AppRateLimiter] Failed to share backoff: {e}")
+
+    async def _wait_if_blocked(self):
+        if self.mode == "mongodb":
+            try:
+                doc = await self.collection.find_one({"_id": f"{self.name}:blocked"})
+                if doc:
+                    self.blocked_until = max(self.blocked_until, doc["blocked_until"])
+            except Exception as e:
+                print(f"[AppRateLimiter] Failed to read shared backoff: {e}")
+        delay = self.blocked_until - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _acquire_local(self, tokens):
+        # The lock is held while waiting so callers are served in arrival order
+        async with self.lock:
+            while True:
+                if self.blocked_until > time.time():
+                    await asyncio.sleep(self.blocked_until - time.time())
+                self._refill()
+                if self.request_allowance >= 1 and self.token_allowance >= tokens:
+                    self.request_allowance -= 1
+                    self.token_allowance -= tokens
+                    return {"window": None, "tokens": tokens}
+                wait_requests = (1 - self.request_allowance) * 60.0 / self.rpm
+                wait_tokens = (tokens - self.token_allowance) * 60.0 / self.tpm
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+    async def _acquire_mongodb(self, tokens):
+        if not self.ttl_index_ready:
+            await self.collection.create_index("expire_at", expireAfterSeconds=0)
+            self.ttl_index_ready = True
+
+        while True:
+            now = time.time()
+            window_start = int(now // 60) * 60
+            window_id = f"{self.name}:{window_start}"
+            try:
+                # Matches only while the window has room; otherwise the upsert
+                # collides with the existing window document
+                doc = await self.collection.find_one_and_update(
+                    {
+                        "_id": window_id,
+                        "requests": {"$lt": self.rpm},
+                        "tokens": {"$lte": self.tpm - tokens},
+                    },
+                    {
+                        "$inc": {"requests": 1, "tokens": tokens},
+                        "$setOnInsert": {
+                            "expire_at": datetime.now(timezone.utc) + timedelta(minutes=5)
+                        },
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                if doc:
+                    return {"window": window_id, "tokens": tokens}
+            except DuplicateKeyError:
+                pass
+            await asyncio.sleep(max(window_start + 60 - now, 0.05))
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "requests_per_minute": self.rpm,
+            "tokens_per_minute": self.tpm,
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 3),
+            "penalties": self.penalties,
+        }
@@ -0,0 +1,58 @@
+# app_records.py
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass(slots=True)
+class ExceptionLink:
+    """A raise/throw/catch link from the fixed object to an exception type."""
+
+    link_type: str
+    exception: str
+
+
+@dataclass(slots=True)
+class ImpactRecord:
+    """A caller of the fixed object, with the code needed for impact analysis."""
+
+    object_id: str
+    object_type: str
+    object_signature: str
+    object_link_type: str
+    object_bookmark_code: str
+    object_source_path: str
+    object_file_id: int
+    object_start_line: int
+    object_end_line: int
+    object_full_code: str
+
+
+@dataclass(slots=True)
+class FixContext:
+    """What Imaging returns for one object to fix: its code, callers and exception context."""
+
+    object_id: str
+    object_type: str
+    object_signature: str
+    object_technology: str
+    object_source_path: str
+    object_file_id: int
+    object_start_line: int
+    object_end_line: int
+    object_code: str
+    impacts: List[ImpactRecord]
+    exception_text: str
+    impact_text: str
+
+
+def group_exceptions(exceptions: List[ExceptionLink]) -> Dict[str, List[str]]:
+    """
+    Group exception names by link type.
+
+    Link types are sorted and names keep their first-seen order without
+    duplicates, matching DataFrame.groupby(...)["exception"].unique().
+    """
+    grouped = {}
+    for link in exceptions:
+        grouped.setdefault(link.link_type, {})[link.exception] = None
+    return {link_type: list(grouped[link_type]) for link_type in sorted(grouped)}
@@ -0,0 +1,83 @@
+# app_retry.py
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from config import Config
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed model call is retried and how long to wait.
+
+    Transport errors and 408/409/425/429/5xx responses are retryable; any other
+    error is fatal. Delays use exponential backoff with full jitter, never less
+    than the server's Retry-After, and stop once the per-object time budget
+    would be exceeded.
+    """
+
+    RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, config: Config):
+        self.max_attempts = config.MODEL_RETRY_MAX_ATTEMPTS
+        self.base_delay = config.MODEL_RETRY_BASE_DELAY
+        self.max_delay = config.MODEL_RETRY_MAX_DELAY
+        self.max_elapsed = config.MODEL_RETRY_MAX_ELAPSED_SECONDS
+
+        self.retries = 0
+        self.fatal = 0
+        self.exhausted = 0
+
+    def deadline(self) -> float:
+        """Monotonic time after which no further retry is attempted."""
+        return time.monotonic() + self.max_elapsed
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.RETRYABLE_STATUS_CODES
+        return isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """Seconds requested by the server through Retry-After(-ms), if any."""
+        if not isinstance(error, httpx.HTTPStatusError):
+            return None
+        headers = error.response.headers
+        value = headers.get("retry-after-ms")
+        if value:
+            try:
+                return max(float(value) / 1000.0, 0.0)
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def next_delay(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """
+        Return the delay before retry number `attempt`, or None to give up.
+        """
+        if not self.is_retryable(error):
+            self.fatal += 1
+            return None
+        delay = max(self.backoff(attempt), self.retry_after(error) or 0.0)
+        if attempt >= self.max_attempts or time.monotonic() + delay > deadline:
+            self.exhausted += 1
+            return None
+        self.retries += 1
+        return delay
+
+    def stats(self):
+        return {"retries": self.retries, "fatal": self.fatal, "exhausted": self.exhausted}
@@ -0,0 +1,49 @@
+# app_runtime.py
+from config import Config
+from app_logger import AppLogger
+from app_events import AppEventWriter
+from app_mongo import AppMongoDb
+from app_llm import AppLLM
+from app_imaging import AppImaging
+from app_code_fixer import AppCodeFixer
+from app_mq import AppMessageQueue
+from app_worker import AppQueueWorker
+
+
+class AppRuntime:
+    """
+    The engine's shared clients, built the same way by the API (main.py) and
+    the standalone worker (worker.py).
+
+    Clients are created in the constructor; open() and close() manage the
+    pooled HTTP clients, so a worker process builds its own runtime after it
+    has started instead of inheriting sockets from a parent.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.mongo_db = AppMongoDb(config)
+        self.events = AppEventWriter(self.mongo_db, config)
+        self.app_logger = AppLogger(self.mongo_db, self.events)
+        self.ai_model = AppLLM(self.app_logger, config, self.mongo_db)
+        self.imaging = AppImaging(self.app_logger, config, self.mongo_db)
+        self.code_fixer = AppCodeFixer(
+            self.app_logger, self.mongo_db, self.ai_model, self.imaging, config
+        )
+        self.mq = AppMessageQueue(self.app_logger, config).open()
+        self.queue_worker = AppQueueWorker(config, self.mq, self.code_fixer, self.events)
+
+    async def open(self):
+        await self.mongo_db.startup()
+        self.events.start()
+        await self.imaging.open()
+        await self.ai_model.open()
+
+    async def close(self):
+        # Workers first (a no-op when already stopped), then the queue they consume
+        await self.queue_worker.stop()
+        await self.mq.close()
+        await self.ai_model.close()
+        await self.imaging.close()
+        # Last, so events of draining jobs are written
+        await self.events.stop()
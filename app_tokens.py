@@ -0,0 +1,77 @@
+# app_tokens.py
+import asyncio
+import hashlib
+from collections import OrderedDict
+from config import Config
+
+
+class AppTokenCounter:
+    """
+    Token accounting for prompts.
+
+    Counts are memoized by content hash, so static templates and JSON schemas
+    are encoded once (see precompute) and a code block counted for the output
+    budget is free when the whole prompt is counted. Large texts are encoded
+    in a worker thread to keep the event loop responsive.
+    """
+
+    # Chat formatting tokens added around a single user message
+    MESSAGE_OVERHEAD = 7
+
+    def __init__(self, encoding, config: Config):
+        self.encoding = encoding
+        self.memo_size = config.TOKEN_COUNT_MEMO_SIZE
+        self.offload_chars = config.TOKEN_COUNT_OFFLOAD_CHARS
+        self.memo = OrderedDict()  # sha1 digest -> token count
+
+        self.hits = 0
+        self.misses = 0
+        self.offloaded = 0
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+
+    def _remember(self, key, count):
+        self.memo[key] = count
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def precompute(self, texts) -> None:
+        """Encode static texts (prompt templates, JSON schemas) once, synchronously."""
+        for text in texts:
+            self._remember(self._key(text), len(self.encoding.encode(text)))
+
+    async def count(self, text: str) -> int:
+        if not text:
+            return 0
+        key = self._key(text)
+        count = self.memo.get(key)
+        if count is not None:
+            self.hits += 1
+            self.memo.move_to_end(key)
+            return count
+
+        self.misses += 1
+        if len(text) >= self.offload_chars:
+            self.offloaded += 1
+            count = await asyncio.to_thread(lambda: len(self.encoding.encode(text)))
+        else:
+            count = len(self.encoding.encode(text))
+        self._remember(key, count)
+        return count
+
+    async def count_prompt(self, parts) -> int:
+        """Tokens of a single-message prompt given as the parts it is joined from."""
+        total = self.MESSAGE_OVERHEAD
+        for part in parts:
+            total += await self.count(str(part))
+        return total
+
+    def stats(self):
+        return {
+            "memo_entries": len(self.memo),
+            "hits": self.hits,
+            "misses": self.misses,
+            "offloaded": self.offloaded,
+        }
@@ -0,0 +1,260 @@
+# app_validators.py
+import ast
+import os
+from html.parser import HTMLParser
+from typing import Callable, Dict, Optional, Tuple
+from config import Config
+
+
+def validate_python(text: str) -> Optional[str]:
+    """Return None if the text parses as Python, otherwise the syntax error."""
+    try:
+        ast.parse(text)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except ValueError as e:  # e.g. null bytes
+        return str(e)
+    return None
+
+
+_PAIRS = {")": "(", "]": "[", "}": "{"}
+
+
+def validate_brackets(text: str) -> Optional[str]:
+    """
+    Balance (), [] and {} in C-family source (C, C++, C#, Java, JavaScript, ...).
+
+    Comments, string and char literals are skipped, including Java text
+    blocks, C# verbatim strings and JavaScript template literals. Constructs
+    the scanner does not understand (e.g. regex literals) can only cause a
+    false failure, which just means the model pass still runs.
+    """
+    stack = []
+    line = 1
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        following = text[i + 1] if i + 1 < length else ""
+        if char == "\n":
+            line += 1
+        elif char == "/" and following == "/":
+            end = text.find("\n", i)
+            i = length if end == -1 else end
+            continue
+        elif char == "/" and following == "*":
+            end = text.find("*/", i + 2)
+            if end == -1:
+                return f"line {line}: unterminated block comment"
+            line += text.count("\n", i, end)
+            i = end + 2
+            continue
+        elif text.startswith('"""', i):
+            end = text.find('"""', i + 3)
+            if end == -1:
+                return f"line {line}: unterminated text block"
+            line += text.count("\n", i, end)
+            i = end + 3
+            continue
+        elif char == "@" and following == '"':
+            # C# verbatim string: no escapes, "" is a quote
+            j = i + 2
+            while True:
+                j = text.find('"', j)
+                if j == -1:
+                    return f"line {line}: unterminated verbatim string"
+                if text.startswith('""', j):
+                    j += 2
+                    continue
+                break
+            line += text.count("\n", i, j)
+            i = j + 1
+            continue
+        elif char in "\"'`":
+            j = i + 1
+            while j < length and text[j] != char:
+                if text[j] == "\\":
+                    j += 1
+                elif text[j] == "\n" and char != "`":
+                    return f"line {line}: unterminated string literal"
+                j += 1
+            if j >= length:
+                return f"line {line}: unterminated string literal"
+            line += text.count("\n", i, j)
+            i = j + 1
+            continue
+        elif char in "([{":
+            stack.append((char, line))
+        elif char in _PAIRS:
+            if not stack or stack[-1][0] != _PAIRS[char]:
+                return f"line {line}: unexpected '{char}'"
+            stack.pop()
+        i += 1
+    if stack:
+        opener, opened = stack[-1]
+        return f"line {opened}: unclosed '{opener}'"
+    return None
+
+
+class _TagBalancer(HTMLParser):
+    # Elements that never have an end tag, or whose end tag is optional in HTML
+    VOID = {
+        "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+        "meta", "param", "source", "track", "wbr", "!doctype",
+    }
+    OPTIONAL_END = {
+        "p", "li", "dt", "dd", "tr", "td", "th", "thead", "tbody", "tfoot",
+        "option", "optgroup", "colgroup", "caption", "rt", "rp",
+    }
+
+    def __init__(self, html: bool):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+        self.stack = []
+        self.error = None
+
+    def _ignored(self, tag):
+        return self.html and (tag in self.VOID or tag in self.OPTIONAL_END)
+
+    def handle_starttag(self, tag, attrs):
+        if not self._ignored(tag):
+            self.stack.append((tag, self.getpos()[0]))
+
+    def handle_endtag(self, tag):
+        if self._ignored(tag) or self.error:
+            return
+        if not self.stack or self.stack[-1][0] != tag:
+            self.error = f"line {self.getpos()[0]}: unexpected </{tag}>"
+            return
+        self.stack.pop()
+
+
+def _validate_tags(text: str, html: bool) -> Optional[str]:
+    parser = _TagBalancer(html)
+    parser.feed(text)
+    parser.close()
+    if parser.error:
+        return parser.error
+    if parser.stack:
+        tag, opened = parser.stack[-1]
+        return f"line {opened}: unclosed <{tag}>"
+    return None
+
+
+def validate_html(text: str) -> Optional[str]:
+    """Balance HTML tags, ignoring void elements and elements with optional end tags."""
+    return _validate_tags(text, html=True)
+
+
+def validate_xml(text: str) -> Optional[str]:
+    """Balance XML tags (self-closing tags are handled by the parser)."""
+    return _validate_tags(text, html=False)
+
+
+# Validators keyed by the normalized technology name Imaging returns (programmingLanguage.name)
+VALIDATORS: Dict[str, Callable[[str], Optional[str]]] = {
+    "python": validate_python,
+    "java": validate_brackets,
+    "c": validate_brackets,
+    "c++": validate_brackets,
+    "c/c++": validate_brackets,
+    "c#": validate_brackets,
+    "javascript": validate_brackets,
+    "typescript": validate_brackets,
+    "kotlin": validate_brackets,
+    "scala": validate_brackets,
+    "go": validate_brackets,
+    "swift": validate_brackets,
+    "html": validate_html,
+    "html5": validate_html,
+    "xml": validate_xml,
+}
+
+# Fallback when the technology is unknown (e.g. files of dependent objects)
+EXTENSIONS = {
+    ".py": "python",
+    ".java": "java",
+    ".c": "c",
+    ".h": "c",
+    ".cc": "c++",
+    ".cpp": "c++",
+    ".cxx": "c++",
+    ".hpp": "c++",
+    ".cs": "c#",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".mjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".kt": "kotlin",
+    ".scala": "scala",
+    ".go": "go",
+    ".swift": "swift",
+    ".html": "html",
+    ".htm": "html",
+    ".xml": "xml",
+    ".xhtml": "xml",
+}
+
+
+def register_validator(technology: str, validator: Callable[[str], Optional[str]], extensions=()) -> None:
+    """Add or replace the validator for a technology (and the file extensions that imply it)."""
+    technology = technology.strip().lower()
+    VALIDATORS[technology] = validator
+    for extension in extensions:
+        EXTENSIONS[extension.lower()] = technology
+
+
+class AppSyntaxValidator:
+    """
+    Local syntax pre-check of fixed files.
+
+    A file that passes does not need the full-file model pass; a file that
+    fails, or whose technology has no validator, still goes to the model.
+    """
+
+    def __init__(self, config: Config):
+        self.enabled = config.SYNTAX_PRECHECK_ENABLED
+
+        self.passed = 0
+        self.failed = 0
+        self.unsupported = 0
+        self.model_calls_avoided = 0
+
+    @staticmethod
+    def technology_for(technology: Optional[str], file_path: str = "") -> Optional[str]:
+        if technology and technology.strip().lower() in VALIDATORS:
+            return technology.strip().lower()
+        extension = os.path.splitext(file_path or "")[1].lower()
+        return EXTENSIONS.get(extension)
+
+    def validate(self, text: str, technology: Optional[str] = None, file_path: str = "") -> Tuple[Optional[bool], str]:
+        """
+        Returns:
+            (True, "") if the file is well-formed, (False, reason) if not,
+            (None, "") if no validator applies or the pre-check is disabled.
+        """
+        if not self.enabled:
+            return None, ""
+        key = self.technology_for(technology, file_path)
+        if key is None:
+            self.unsupported += 1
+            return None, ""
+        try:
+            error = VALIDATORS[key](text)
+        except Exception as e:
+            error = f"validator error: {e}"
+        if error:
+            self.failed += 1
+            return False, error
+        self.passed += 1
+        return True, ""
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "passed": self.passed,
+            "failed": self.failed,
+            "unsupported": self.unsupported,
+            "model_calls_avoided": self.model_calls_avoided,
+        }
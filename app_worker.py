@@ -0,0 +1,186 @@
+# app_worker.py
+import asyncio
+import time
+from datetime import datetime, timezone
+from config import Config
+
+
+class AppQueueWorker:
+    """
+    Pool of queue consumers running process_request_logic.
+
+    Each of the MAX_THREADS workers claims its own job from the status queue,
+    so one slow request no longer holds back the others. stop() lets running
+    jobs finish for up to WORKER_DRAIN_TIMEOUT_SECONDS before cancelling them;
+    a cancelled job is put back in the queue.
+    """
+
+    def __init__(self, config: Config, mq, code_fixer, events, topic="status_queue"):
+        self.mq = mq
+        self.events = events
+        self.code_fixer = code_fixer
+        self.topic = topic
+        self.worker_count = max(1, int(config.MAX_THREADS))
+        self.drain_timeout = config.WORKER_DRAIN_TIMEOUT_SECONDS
+        self.stopping = asyncio.Event()
+        self.tasks = []
+        self.workers = [
+            {
+                "state": "stopped",
+                "request_id": None,
+                "jobs": 0,
+                "failures": 0,
+                "busy_seconds": 0.0,
+                "idle_seconds": 0.0,
+            }
+            for _ in range(self.worker_count)
+        ]
+        self.state_since = [time.monotonic()] * self.worker_count
+
+    def start(self):
+        self.stopping.clear()
+        self.tasks = [
+            asyncio.create_task(self.run(index), name=f"queue-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        print(f"[WORKER] Background queue processor started with {self.worker_count} workers.")
+
+    async def stop(self):
+        """Stop claiming jobs, drain running ones, then cancel whatever is left."""
+        self.stopping.set()
+        if not self.tasks:
+            return
+        done, pending = await asyncio.wait(self.tasks, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            print(f"[WORKER] Cancelled {len(pending)} workers after {self.drain_timeout}s drain timeout.")
+        self.tasks = []
+
+    def _set_state(self, index: int, state: str):
+        """Charge the time spent in the previous state, then switch."""
+        stats = self.workers[index]
+        now = time.monotonic()
+        if stats["state"] in ("busy", "idle"):
+            stats[f"{stats['state']}_seconds"] += now - self.state_since[index]
+        stats["state"] = state
+        self.state_since[index] = now
+
+    async def run(self, index: int):
+        stats = self.workers[index]
+        self._set_state(index, "idle")
+        try:
+            while not self.stopping.is_set():
+                try:
+                    started = time.monotonic()
+                    doc = await self.mq.get(self.topic, timeout=5)
+                    if not doc:
+                        # Backends that wait for jobs inside get() need no extra pause
+                        if time.monotonic() - started >= 1:
+                            continue
+                        # Idle pause, cut short by stop()
+                        try:
+                            await asyncio.wait_for(self.stopping.wait(), timeout=1)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+
+                    self._set_state(index, "busy")
+                    stats["request_id"] = doc["request_id"]
+                    try:
+                        await self.process(doc, stats)
+                    finally:
+                        stats["request_id"] = None
+                        self._set_state(index, "idle")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[WORKER ERROR] {e}")
+                    await asyncio.sleep(2)
+        finally:
+            self._set_state(index, "stopped")
+
+    async def process(self, doc, stats):
+        request_id = doc["request_id"]
+        retry_count = doc.get("retry_count", 0)
+
+        print(f"[WORKER] Processing: {request_id}")
+        await self.events.write("audit_log", {
+            "request_id": request_id,
+            "event": "processing",
+            "timestamp": time.time(),
+            "created_at": datetime.now(timezone.utc)
+        })
+
+        # Keep the job's lease alive while it runs (backends with leases only)
+        heartbeat = None
+        if hasattr(self.mq, "renew"):
+            heartbeat = asyncio.create_task(self.heartbeat(request_id))
+        try:
+            result = await self.code_fixer.process_request_logic(
+                request_id, force_regenerate=doc.get("force_regenerate", False)
+            )
+        except asyncio.CancelledError:
+            # Shutdown interrupted the job: hand it back to the queue for the next run
+            await self.mq.publish(self.topic, {
+                "request_id": request_id,
+                "status": "queued",
+                "retry_count": retry_count,
+                "force_regenerate": doc.get("force_regenerate", False)
+            })
+            await self.mq.ack(self.topic, doc)
+            raise
+        except Exception:
+            await self.mq.nack(self.topic, doc)
+            raise
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+        status = "Completed" if result.get("status") == "success" else "Failed"
+        stats["jobs"] += 1
+        if status == "Failed":
+            stats["failures"] += 1
+
+        await self.mq.set_status(self.topic, {
+            "request_id": request_id,
+            "status": status.lower(),
+            "retry_count": retry_count,
+            "response": result
+        })
+        # Acknowledged only once the result is recorded
+        await self.mq.ack(self.topic, doc)
+
+        await self.events.write("audit_log", {
+            "request_id": request_id,
+            "event": status.lower(),
+            "timestamp": time.time(),
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    async def heartbeat(self, request_id):
+        while True:
+            await asyncio.sleep(self.mq.heartbeat_seconds)
+            if not await self.mq.renew(self.topic, request_id):
+                print(f"[WORKER] Lost the lease on {request_id}; it may be processed again.")
+                return
+
+    def stats(self):
+        workers = []
+        now = time.monotonic()
+        for index, stats in enumerate(self.workers):
+            busy = stats["busy_seconds"]
+            idle = stats["idle_seconds"]
+            # Include the time spent so far in the current state
+            if stats["state"] == "busy":
+                busy += now - self.state_since[index]
+            elif stats["state"] == "idle":
+                idle += now - self.state_since[index]
+            workers.append({
+                "worker": index,
+                **stats,
+                "busy_seconds": round(busy, 3),
+                "idle_seconds": round(idle, 3),
+                "utilization": round(busy / (busy + idle), 3) if busy + idle else 0.0,
+            })
+        return {"workers": self.worker_count, "stopping": self.stopping.is_set(), "per_worker": workers}
@@ -0,0 +1,105 @@
+# bench_impact_records.py
+"""
+Micro-benchmark: DataFrame accumulation vs. slotted records for impact rows.
+
+Replays what __gen_code_connected_json does for an object with N callers:
+append one impact row and a few exception links per caller, then build the
+impact text and the grouped exception text.
+
+Usage: python bench_impact_records.py [callers] [repeats]
+"""
+import sys
+import time
+import tracemalloc
+
+from app_records import ExceptionLink, ImpactRecord, group_exceptions
+
+
+def _callers(count):
+    for i in range(count):
+        yield {
+            "object_id": str(100000 + i),
+            "object_type": "Java Method",
+            "object_signature": f"com.acme.Service{i % 50}.call{i}(String)",
+            "object_link_type": "callLink",
+            "object_bookmark_code": f"service.call{i}(value);",
+            "object_source_path": f"src/main/java/com/acme/Service{i % 50}.java",
+            "object_file_id": i % 50,
+            "object_start_line": i,
+            "object_end_line": i + 20,
+            "object_full_code": "    public void call() {\n        doWork();\n    }\n" * 5,
+        }
+
+
+def _exceptions(count):
+    link_types = ["throw", "catch", "raise"]
+    for i in range(count):
+        yield {"link_type": link_types[i % 3], "exception": f"Exception{i % 7}"}
+
+
+def run_dataframe(count):
+    import pandas as pd
+
+    exceptions = pd.DataFrame(columns=["link_type", "exception"])
+    impacts = pd.DataFrame(
+        columns=["object_type", "object_signature", "object_link_type", "object_code"]
+    )
+    for row in _exceptions(count):
+        new_row = pd.DataFrame({key: [value] for key, value in row.items()})
+        exceptions = pd.concat([exceptions, new_row], ignore_index=True)
+    for row in _callers(count):
+        new_row = pd.DataFrame({key: [value] for key, value in row.items()})
+        impacts = pd.concat([impacts, new_row], ignore_index=True)
+
+    grouped = exceptions.groupby("link_type")["exception"].unique()
+    exception_text = "; ".join(f"{link_type} {', '.join(exc)}" for link_type, exc in grouped.items())
+    impact_text = ""
+    for i, row in impacts.iterrows():
+        impact_text += f" {i + 1}. {row['object_type']} <{row['object_signature']}> has a <{row['object_link_type']}> dependency\n"
+        impact_text += f"````\n\t{row['object_bookmark_code']}\n````\n"
+    return exception_text, impact_text
+
+
+def run_records(count):
+    exceptions = [ExceptionLink(**row) for row in _exceptions(count)]
+    impacts = [ImpactRecord(**row) for row in _callers(count)]
+
+    grouped = group_exceptions(exceptions)
+    exception_text = "; ".join(f"{link_type} {', '.join(exc)}" for link_type, exc in grouped.items())
+    impact_text = ""
+    for i, row in enumerate(impacts):
+        impact_text += f" {i + 1}. {row.object_type} <{row.object_signature}> has a <{row.object_link_type}> dependency\n"
+        impact_text += f"````\n\t{row.object_bookmark_code}\n````\n"
+    return exception_text, impact_text
+
+
+def measure(label, func, count, repeats):
+    best = float("inf")
+    peak = 0
+    for _ in range(repeats):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = func(count)
+        best = min(best, time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    print(f"{label:<10} best {best * 1000:9.1f} ms   peak {peak / 1024:9.1f} KiB")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print(f"{count} callers, best of {repeats}")
+
+    started = time.perf_counter()
+    import pandas  # noqa: F401
+    print(f"pandas import {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    records_result = measure("records", run_records, count, repeats)
+    dataframe_result = measure("dataframe", run_dataframe, count, repeats)
+    print("outputs identical:", records_result == dataframe_result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# check_mq_kafka.py
+"""
+Checks of the KafkaMQ offset and rebalance invariants against a fake
+consumer (no Kafka broker or MongoDB server needed).
+
+- a partition is committed only up to its oldest job still in flight, so a
+  crash replays every unfinished job
+- partitions are paused while KAFKA_PREFETCH jobs are uncompleted, and
+  resumed once one completes
+- on revocation, completed work is committed, unfinished work is not
+  skipped, jobs not handed out yet are dropped, and late acks of the
+  revoked partition are ignored
+
+Usage: python check_mq_kafka.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+from aiokafka import TopicPartition
+
+from app_mq_kafka import KafkaMQ, _Rebalance
+
+TOPIC = "status_queue"
+P0 = TopicPartition(TOPIC, 0)
+P1 = TopicPartition(TOPIC, 1)
+
+
+def _config(**overrides):
+    config = SimpleNamespace(
+        MONGODB_CONNECTION_STRING="mongodb://localhost:27017",
+        MONGODB_NAME="check",
+        KAFKA_BOOTSTRAP_SERVERS="localhost:9092",
+        KAFKA_GROUP_ID="check",
+        KAFKA_AUTO_OFFSET_RESET="earliest",
+        KAFKA_PREFETCH=None,
+        MAX_THREADS=10,
+    )
+    config.__dict__.update(overrides)
+    return config
+
+
+class FakeStatusCollection:
+    async def update_one(self, query, update, upsert=False):
+        pass
+
+
+class FakeStatusDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeStatusCollection()
+        return self[name]
+
+
+class FakeConsumer:
+    """The subset of AIOKafkaConsumer KafkaMQ uses, fed by add()."""
+
+    def __init__(self, partitions):
+        self.partitions = set(partitions)
+        self.paused_partitions = set()
+        self.pending = {tp: [] for tp in partitions}
+        self.commits = []  # every {TopicPartition: offset} committed, in order
+
+    def add(self, tp, *offsets):
+        for offset in offsets:
+            self.pending[tp].append(SimpleNamespace(
+                offset=offset, value={"request_id": f"{tp.partition}-{offset}", "retry_count": 0}
+            ))
+
+    def assignment(self):
+        return set(self.partitions)
+
+    def paused(self):
+        return set(self.paused_partitions)
+
+    def pause(self, *partitions):
+        self.paused_partitions.update(partitions)
+
+    def resume(self, *partitions):
+        self.paused_partitions.difference_update(partitions)
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        batches = {}
+        for tp in sorted(self.partitions - self.paused_partitions):
+            records = self.pending[tp][:max_records]
+            if records:
+                del self.pending[tp][:len(records)]
+                batches[tp] = records
+                max_records -= len(records)
+            if not max_records:
+                break
+        if not batches:
+            await asyncio.sleep(0.01)
+        return batches
+
+    async def commit(self, offsets):
+        self.commits.append(dict(offsets))
+
+    async def stop(self):
+        pass
+
+    def committed(self, tp):
+        offsets = [commit[tp] for commit in self.commits if tp in commit]
+        return offsets[-1] if offsets else None
+
+
+def _queue(consumer, **overrides):
+    mq = KafkaMQ(_config(**overrides))
+    mq.db = FakeStatusDb()
+
+    async def start_consumer(topic, deliveries):
+        mq.consumers[topic] = consumer
+        mq.fetchers[topic] = asyncio.create_task(mq._fetch(topic))
+
+    mq._start_consumer = start_consumer
+    return mq
+
+
+async def _take(mq, count):
+    docs = []
+    for _ in range(count):
+        doc = await mq.get(TOPIC, timeout=1)
+        assert doc is not None, f"only {len(docs)} of {count} jobs were delivered"
+        docs.append(doc)
+    return docs
+
+
+async def check_commit_oldest_in_flight():
+    consumer = FakeConsumer([P0])
+    consumer.add(P0, 10, 11, 12)
+    mq = _queue(consumer)
+    first, second, third = await _take(mq, 3)
+
+    await mq.ack(TOPIC, second)
+    assert consumer.committed(P0) == 10, "committed past a job still in flight"
+    await mq.ack(TOPIC, first)
+    assert consumer.committed(P0) == 12, consumer.commits
+    await mq.ack(TOPIC, third)
+    assert consumer.committed(P0) == 13, consumer.commits
+    await mq.close()
+
+
+async def check_prefetch_pause():
+    consumer = FakeConsumer([P0])
+    consumer.add(P0, 0, 1, 2)
+    mq = _queue(consumer, KAFKA_PREFETCH=2)
+    first, second = await _take(mq, 2)
+    await asyncio.sleep(0.05)
+    assert P0 in consumer.paused(), "the partition was not paused with the prefetch full"
+    assert mq.deliveries[TOPIC].empty(), "fetched beyond the prefetch"
+
+    await mq.ack(TOPIC, first)
+    (third,) = await _take(mq, 1)
+    assert third["_offset"] == 2
+    await mq.ack(TOPIC, second)
+    await mq.ack(TOPIC, third)
+    assert consumer.committed(P0) == 3, consumer.commits
+    await mq.close()
+
+
+async def check_rebalance_revoke():
+    consumer = FakeConsumer([P0, P1])
+    consumer.add(P0, 0, 1)
+    consumer.add(P1, 0, 1)
+    mq = _queue(consumer)
+    # Deliveries arrive as P0#0, P0#1, P1#0, P1#1; P1#1 is never handed out
+    p0_first, p0_second, p1_first = await _take(mq, 3)
+    assert p1_first["_partition"] == 1 and mq.deliveries[TOPIC].qsize() == 1
+
+    await _Rebalance(mq, TOPIC).on_partitions_revoked({P1})
+    assert consumer.committed(P1) in (None, 0), "revocation skipped an unfinished job"
+    assert P1 not in mq.inflight, "state of the revoked partition was kept"
+    assert mq.deliveries[TOPIC].empty(), "a job of the revoked partition was still queued"
+
+    # The new owner replays P1#0; acking it here must not commit anything
+    commits = len(consumer.commits)
+    await mq.ack(TOPIC, p1_first)
+    assert len(consumer.commits) == commits, "acked a job of a revoked partition"
+
+    await mq.ack(TOPIC, p0_first)
+    await mq.ack(TOPIC, p0_second)
+    assert consumer.committed(P0) == 2, consumer.commits
+    await mq.close()
+
+
+async def main():
+    checks = [
+        check_commit_oldest_in_flight,
+        check_prefetch_pause,
+        check_rebalance_revoke,
+    ]
+    for check in checks:
+        await check()
+        print(f"ok  {check.__name__}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
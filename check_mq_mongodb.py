@@ -0,0 +1,286 @@
+# check_mq_mongodb.py
+"""
+Checks of the MongoDBMQ claim, lease and wake-up invariants against an
+in-memory fake of the status collection (no MongoDB server needed).
+
+- a queued job is claimed once, with this worker's id and a lease
+- only the lease owner can renew; a reaped job's old owner loses its lease
+- the reaper re-queues expired (and pre-lease) jobs, leaves live leases alone,
+  dead-letters jobs over MQ_MAX_RETRIES, and handles each job once when
+  several reapers race
+- without a replica set (error 40573) claimers fall back to polling
+- a change stream event wakes an idle claimer before its poll interval
+- the polling backoff is kept per caller
+
+Usage: python check_mq_mongodb.py
+"""
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+from pymongo.errors import OperationFailure
+
+from app_mq_mongodb import MongoDBMQ
+
+TOPIC = "status_queue"
+
+
+def _config(**overrides):
+    config = SimpleNamespace(
+        MONGODB_CONNECTION_STRING="mongodb://localhost:27017",
+        MONGODB_NAME="check",
+        MQ_LEASE_SECONDS=30,
+        MQ_HEARTBEAT_SECONDS=10,
+        MQ_MAX_RETRIES=2,
+        MQ_REAPER_INTERVAL_SECONDS=3600,
+        MQ_CONSUMER_MODE="poll",
+        MQ_POLL_MIN_INTERVAL=0.01,
+        MQ_POLL_MAX_INTERVAL=0.08,
+    )
+    config.__dict__.update(overrides)
+    return config
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$lt" and not (value is not None and value < operand):
+                    return False
+                if operator == "$exists" and (key in doc) != operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            await asyncio.sleep(0)  # let concurrent reapers interleave
+            yield dict(doc)
+
+
+class FakeStream:
+    def __init__(self, collection):
+        self.collection = collection
+        self.events = asyncio.Queue()
+
+    async def __aenter__(self):
+        if self.collection.watch_error is not None:
+            raise self.collection.watch_error
+        self.collection.streams.append(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.collection.streams.remove(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.events.get()
+
+
+class FakeCollection:
+    """The subset of a Motor collection MongoDBMQ uses."""
+
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.docs = []
+        self.streams = []
+        self.watch_error = None
+
+    def _apply(self, doc, update):
+        doc.update(update.get("$set", {}))
+        for key in update.get("$unset", {}):
+            doc.pop(key, None)
+        if doc.get("status") == "queued":
+            for stream in self.streams:
+                stream.events.put_nowait({"operationType": "update"})
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if _matches(doc, query):
+                self._apply(doc, update)
+                return SimpleNamespace(matched_count=1, modified_count=1)
+        if upsert:
+            doc = {"_id": next(self.ids), **{k: v for k, v in query.items() if not k.startswith("$")}}
+            self.docs.append(doc)
+            self._apply(doc, update)
+        return SimpleNamespace(matched_count=0, modified_count=0)
+
+    async def find_one_and_update(self, query, update, sort=None):
+        candidates = [doc for doc in self.docs if _matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            candidates.sort(key=lambda doc: doc.get(key, 0), reverse=direction < 0)
+        if not candidates:
+            return None
+        before = dict(candidates[0])
+        self._apply(candidates[0], update)
+        return before
+
+    async def find_one(self, query, sort=None):
+        for doc in self.docs:
+            if _matches(doc, query):
+                return dict(doc)
+        return None
+
+    def find(self, query):
+        return FakeCursor([doc for doc in self.docs if _matches(doc, query)])
+
+    async def insert_one(self, doc):
+        self.docs.append({"_id": next(self.ids), **doc})
+
+    def watch(self, pipeline):
+        return FakeStream(self)
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def _queue(db=None, **overrides):
+    mq = MongoDBMQ(_config(**overrides))
+    mq.db = db if db is not None else FakeDb()
+    mq.last_reap = time.time()  # reaping is checked explicitly below
+    return mq
+
+
+async def check_claim():
+    mq = _queue()
+    await mq.publish(TOPIC, {"request_id": "r1", "status": "queued", "retry_count": 0})
+    doc = await mq.get(TOPIC, timeout=0.1)
+    assert doc["request_id"] == "r1"
+    stored = await mq.db[TOPIC].find_one({"request_id": "r1"})
+    assert stored["status"] == "processing" and stored["worker_id"] == mq.worker_id
+    assert stored["lease_expires"] > time.time()
+    assert await mq.get(TOPIC, timeout=0.05) is None, "a claimed job was handed out twice"
+
+
+async def check_lease_owner():
+    db = FakeDb()
+    owner, other = _queue(db), _queue(db)
+    await owner.publish(TOPIC, {"request_id": "r1", "status": "queued"})
+    await owner.get(TOPIC, timeout=0.1)
+    assert await owner.renew(TOPIC, "r1")
+    assert not await other.renew(TOPIC, "r1"), "a worker renewed a lease it does not hold"
+
+
+async def check_reaper():
+    db = FakeDb()
+    owner = _queue(db)
+    reapers = [_queue(db), _queue(db)]
+    now = time.time()
+    collection = db[TOPIC]
+    await collection.insert_one({"request_id": "expired", "status": "processing", "worker_id": owner.worker_id,
+                                 "lease_expires": now - 1, "retry_count": 0, "timestamp": now})
+    await collection.insert_one({"request_id": "live", "status": "processing", "worker_id": owner.worker_id,
+                                 "lease_expires": now + 60, "retry_count": 0, "timestamp": now})
+    await collection.insert_one({"request_id": "legacy", "status": "processing",
+                                 "processing_start": now - 3600, "retry_count": 0, "timestamp": now})
+    await collection.insert_one({"request_id": "poison", "status": "processing", "worker_id": owner.worker_id,
+                                 "lease_expires": now - 1, "retry_count": 2, "timestamp": now})
+
+    # Racing reapers must handle each expired job exactly once
+    await asyncio.gather(*[reaper.reap(TOPIC) for reaper in reapers])
+
+    expired = await collection.find_one({"request_id": "expired"})
+    assert expired["status"] == "queued" and expired["retry_count"] == 1, expired
+    assert "worker_id" not in expired and "lease_expires" not in expired
+    live = await collection.find_one({"request_id": "live"})
+    assert live["status"] == "processing" and live["retry_count"] == 0, "a live lease was reaped"
+    legacy = await collection.find_one({"request_id": "legacy"})
+    assert legacy["status"] == "queued" and legacy["retry_count"] == 1, legacy
+    poison = await collection.find_one({"request_id": "poison"})
+    assert poison["status"] == "dead" and poison["retry_count"] == 3, poison
+    dead_letters = db[f"{TOPIC}_dead_letter"].docs
+    assert [doc["request_id"] for doc in dead_letters] == ["poison"], dead_letters
+
+    assert not await owner.renew(TOPIC, "expired"), "the old owner kept a reaped lease"
+
+
+async def check_polling_fallback():
+    mq = _queue(MQ_CONSUMER_MODE="change_stream")
+    mq.db[TOPIC].watch_error = OperationFailure(
+        "The $changeStream stage is only supported on replica sets", code=40573
+    )
+    assert await mq.get(TOPIC, timeout=0.05) is None
+    await asyncio.sleep(0)
+    assert mq.watchers[TOPIC].done() and not mq.streaming.get(TOPIC), "the watcher did not give up"
+
+    await mq.publish(TOPIC, {"request_id": "r1", "status": "queued"})
+    doc = await mq.get(TOPIC, timeout=1)
+    assert doc and doc["request_id"] == "r1", "polling did not pick up the job"
+    await mq.close()
+
+
+async def check_change_stream_wakeup():
+    # Polling alone would not look again for 10 seconds
+    mq = _queue(MQ_CONSUMER_MODE="change_stream", MQ_POLL_MIN_INTERVAL=10, MQ_POLL_MAX_INTERVAL=10)
+    claimer = asyncio.create_task(mq.get(TOPIC, timeout=5))
+    while not mq.streaming.get(TOPIC):
+        await asyncio.sleep(0.01)
+    started = time.monotonic()
+    await mq.publish(TOPIC, {"request_id": "r1", "status": "queued"})
+    doc = await claimer
+    assert doc and doc["request_id"] == "r1"
+    assert time.monotonic() - started < 1, "the change stream did not wake the claimer"
+    await mq.close()
+
+
+async def check_backoff_per_caller():
+    mq = _queue(MQ_POLL_MAX_INTERVAL=10)
+    collection = mq.db[TOPIC]
+    polls = {}
+    claim = collection.find_one_and_update
+
+    async def counted_claim(*args, **kwargs):
+        task = asyncio.current_task()
+        polls[task] = polls.get(task, 0) + 1
+        return await claim(*args, **kwargs)
+
+    collection.find_one_and_update = counted_claim
+
+    async def idle_worker():
+        await mq.get(TOPIC, timeout=0.3)
+        return polls[asyncio.current_task()]
+
+    alone = await asyncio.create_task(idle_worker())
+    together = await asyncio.gather(*[asyncio.create_task(idle_worker()) for _ in range(8)])
+    # Sharing the queue object must not make anyone back off faster than a lone worker
+    # (one poll fewer allowed for scheduling jitter)
+    assert all(count >= alone - 1 for count in together), (alone, together)
+
+
+async def main():
+    checks = [
+        check_claim,
+        check_lease_owner,
+        check_reaper,
+        check_polling_fallback,
+        check_change_stream_wakeup,
+        check_backoff_per_caller,
+    ]
+    for check in checks:
+        await check()
+        print(f"ok  {check.__name__}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
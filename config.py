@@ -5,28 +5,127 @@ class Config:
     MODEL_API_KEY = ""
     MODEL_MAX_INPUT_TOKENS = 
     MODEL_MAX_OUTPUT_TOKENS = 
-    MODEL_INVOCATION_DELAY_IN_SECONDS = 
+    # Structured output support per model name: "json_schema", "json_object" or "none"
+    MODEL_RESPONSE_FORMAT = {}  # e.g. {"gpt-4o": "json_schema"}
+    # Stream completions (SSE) and stop unmodified answers before the echoed code
+    MODEL_STREAMING = False
+    MODEL_STREAM_EARLY_ABORT = True
+    # Retries of transient model errors (429, 5xx, timeouts)
+    MODEL_RETRY_MAX_ATTEMPTS = 6
+    MODEL_RETRY_BASE_DELAY = 1.0
+    MODEL_RETRY_MAX_DELAY = 60.0
+    MODEL_RETRY_MAX_ELAPSED_SECONDS = 600
+    # Token counting: memoized counts, large texts encoded off the event loop
+    TOKEN_COUNT_MEMO_SIZE = 10000
+    TOKEN_COUNT_OFFLOAD_CHARS = 20000
+    # Model call budget, enforced by AppRateLimiter
+    MODEL_REQUESTS_PER_MINUTE = 60
+    MODEL_TOKENS_PER_MINUTE = 200000
+    MODEL_RATE_LIMITER = "local"  # or "mongodb" to share the budget across workers
+    # Cache of completions keyed by hash(model, prompt, JSON schema)
+    MODEL_RESPONSE_CACHE_ENABLED = True
+    MODEL_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    MODEL_RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+    MODEL_RESPONSE_CACHE_MONGO_ENABLED = True
+    # Shared model connection pool
+    MODEL_MAX_CONNECTIONS = 20
+    MODEL_MAX_KEEPALIVE_CONNECTIONS = 10
+    MODEL_KEEPALIVE_EXPIRY = 60.0
+    MODEL_CONNECT_TIMEOUT = 10.0
+    MODEL_READ_TIMEOUT = 300.0
 
     IMAGING_URL = ""
     IMAGING_API_KEY = ""
+    # Shared Imaging connection pool
+    IMAGING_MAX_CONNECTIONS = 50
+    IMAGING_MAX_KEEPALIVE_CONNECTIONS = 20
+    IMAGING_KEEPALIVE_EXPIRY = 30.0
+    IMAGING_CONNECT_TIMEOUT = 10.0
+    IMAGING_READ_TIMEOUT = 60.0
+    IMAGING_HTTP2 = False  # requires the 'h2' package
+    # Max concurrent caller/callee lookups per tenant
+    IMAGING_FANOUT_LIMIT = 8
+    IMAGING_FANOUT_LIMIT_PER_TENANT = {}  # e.g. {"default": 16}
+    # Imaging response cache (in-memory LRU, optional shared MongoDB tier)
+    IMAGING_CACHE_ENABLED = True
+    IMAGING_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    IMAGING_CACHE_TTL_SECONDS = 3600
+    IMAGING_CACHE_MONGO_ENABLED = False
+    # Fetch whole files once and serve line ranges from an indexed buffer
+    IMAGING_FILE_FIRST = False
+    IMAGING_FILE_BUFFER_MAX_BYTES = 128 * 1024 * 1024
 
     MONGODB_CONNECTION_STRING = ""
     MONGODB_NAME = ""
 
+    # Create the indexes of every hot query at startup, then warn about plans still scanning collections
+    MONGODB_ENSURE_INDEXES = True
+    MONGODB_CHECK_QUERY_PLANS = True
+    # Retention of audit_log and ExceptionLog documents (TTL on their created_at date)
+    AUDIT_LOG_TTL_DAYS = 30
+    EXCEPTION_LOG_TTL_DAYS = 90
+    # audit_log/ExceptionLog events are buffered and written with insert_many
+    EVENT_BUFFER_SIZE = 10000
+    EVENT_BATCH_SIZE = 500
+    EVENT_FLUSH_INTERVAL_SECONDS = 1.0
+
     # Use queue mechanism
     MQ_VENDOR = "mongodb"  # or "kafka" or "rabbitmq"
 
+    # MongoDB queue leases: a claimed job is re-queued when its worker stops renewing it
+    MQ_LEASE_SECONDS = 120
+    MQ_HEARTBEAT_SECONDS = 30
+    MQ_REAPER_INTERVAL_SECONDS = 30
+    # Re-queues after an expired lease before a job is dead-lettered
+    MQ_MAX_RETRIES = 3
+    # "polling", or "change_stream" to wake idle workers as soon as a job is queued (needs a replica set)
+    MQ_CONSUMER_MODE = "polling"
+    # Idle polling interval, doubled after every empty poll up to the maximum
+    MQ_POLL_MIN_INTERVAL = 0.5
+    MQ_POLL_MAX_INTERVAL = 5
+
     # RabbitMQ configs (if used)
     RABBITMQ_HOST = "localhost"
     RABBITMQ_PORT = 5672
     RABBITMQ_VHOST = "/"
     RABBITMQ_USER = ""
     RABBITMQ_PASSWORD = ""
+    # Unacked jobs pushed to each worker process (None: MAX_THREADS)
+    RABBITMQ_PREFETCH = None
+    RABBITMQ_CHANNEL_POOL_SIZE = 4
+    RABBITMQ_CONFIRM_BATCH_SIZE = 100
 
     # Kafka configs (if used)
     KAFKA_BOOTSTRAP_SERVERS = "localhost:9092"
     KAFKA_GROUP_ID = ""
     KAFKA_AUTO_OFFSET_RESET = ""
+    # Uncompleted jobs held by each worker process (None: MAX_THREADS)
+    KAFKA_PREFETCH = None
 
+    # Queue workers processing requests concurrently
     MAX_THREADS = 2
+    # Seconds running jobs may take to finish on shutdown before they are cancelled and requeued
+    WORKER_DRAIN_TIMEOUT_SECONDS = 60
+    # Set to False when queue workers run as separate processes (python -m worker)
+    API_RUNS_QUEUE_WORKERS = True
+    # Worker processes started by python -m worker (each runs MAX_THREADS queue workers)
+    WORKER_PROCESSES = 1
+    # Restart of crashed worker processes: the delay doubles up to the maximum while a
+    # process keeps exiting within WORKER_RESTART_STABLE_SECONDS of its start, and the
+    # pool exits with an error after WORKER_RESTART_MAX_FAILURES such failures in a row
+    WORKER_RESTART_MAX_DELAY = 60
+    WORKER_RESTART_STABLE_SECONDS = 60
+    WORKER_RESTART_MAX_FAILURES = 5
+    # Objects of one request processed concurrently
+    MAX_CONCURRENT_OBJECTS = 4
+    # Final check of fixed files: "full" resends whole files, "diff" only edited regions
+    FULLFILE_VALIDATION_MODE = "full"
+    FULLFILE_VALIDATION_CONTEXT_LINES = 10
+    FULLFILE_VALIDATION_HEADER_LINES = 200
+    # Skip the final model pass for files that pass a local syntax check
+    SYNTAX_PRECHECK_ENABLED = True
+    # Batch objects sharing a prompt into one model call: "off", "file" (same source file) or "prompt"
+    FIX_BATCH_MODE = "off"
+    FIX_BATCH_MAX_OBJECTS = 5
+    FIX_BATCH_MAX_CODE_TOKENS = 4000
     PORT = 8081
@@ -1,69 +1,33 @@
 # main.py
-import asyncio
 import time
+from datetime import datetime, timezone
 import urllib3
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from config import Config
-from app_logger import AppLogger
-from app_mongo import AppMongoDb
-from app_llm import AppLLM
-from app_imaging import AppImaging
-from app_code_fixer import AppCodeFixer
-from app_mq import AppMessageQueue
+from app_runtime import AppRuntime
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 config = Config()
-mongo_db = AppMongoDb(config)
-app_logger = AppLogger(mongo_db)
-ai_model = AppLLM(app_logger, config)
-imaging = AppImaging(app_logger, config)
-code_fixer = AppCodeFixer(app_logger, mongo_db, ai_model, imaging)
-mq = AppMessageQueue(app_logger, config).open()
+runtime = AppRuntime(config)
+mongo_db = runtime.mongo_db
+ai_model = runtime.ai_model
+imaging = runtime.imaging
+code_fixer = runtime.code_fixer
+mq = runtime.mq
+queue_worker = runtime.queue_worker
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async def worker():
-        print("[WORKER] Background queue processor started.")
-        while True:
-            try:
-                doc = await mq.get("status_queue", timeout=5)
-                if doc:
-                    request_id = doc["request_id"]
-                    retry_count = doc.get("retry_count", 0)
-
-                    print(f"[WORKER] Processing: {request_id}")
-                    await mq.db["audit_log"].insert_one({
-                        "request_id": request_id,
-                        "event": "processing",
-                        "timestamp": time.time()
-                    })
-
-                    result = await code_fixer.process_request_logic(request_id)
-                    status = "Completed" if result.get("status") == "success" else "Failed"
-
-                    await mq.publish("status_queue", {
-                        "request_id": request_id,
-                        "status": status.lower(),
-                        "retry_count": retry_count,
-                        "response": result
-                    })
-
-                    await mq.db["audit_log"].insert_one({
-                        "request_id": request_id,
-                        "event": status.lower(),
-                        "timestamp": time.time()
-                    })
-                else:
-                    await asyncio.sleep(1)
-            except Exception as e:
-                print(f"[WORKER ERROR] {e}")
-                await asyncio.sleep(2)
-
-    asyncio.create_task(worker())
+    await runtime.open()
+    # With standalone workers (python -m worker) the API only enqueues requests
+    if config.API_RUNS_QUEUE_WORKERS:
+        queue_worker.start()
     yield
+    await queue_worker.stop()
+    await runtime.close()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
@@ -80,18 +44,38 @@ async def check_mongodb_connection():
     except Exception as e:
         return {"status": 500, "error": str(e)}
 
+@app.get("/api-python/v1/EngineStats")
+async def engine_stats():
+    return {
+        "status": 200,
+        "imaging_cache": imaging.cache.stats() if imaging.cache else None,
+        "imaging_file_buffers": imaging.file_buffers.stats(),
+        "rate_limiter": ai_model.rate_limiter.stats(),
+        "llm_retries": ai_model.retry_policy.stats(),
+        "llm_response_cache": ai_model.response_cache.stats() if ai_model.response_cache else None,
+        "llm_saved_tokens": ai_model.saved_tokens,
+        "llm_json_parsing": ai_model.json_stats,
+        "token_counter": ai_model.token_counter.stats(),
+        "syntax_precheck": code_fixer.syntax_validator.stats(),
+        "fix_batching": code_fixer.batch_stats,
+        "queue_workers": queue_worker.stats(),
+        "event_writer": runtime.events.stats(),
+    }
+
 @app.get("/api-python/v1/ProcessRequest/{request_id}")
-async def process_request(request_id: str):
+async def process_request(request_id: str, force: bool = False):
     try:
         await mq.publish("status_queue", {
             "request_id": request_id,
             "status": "queued",
-            "retry_count": 0
+            "retry_count": 0,
+            "force_regenerate": force
         })
-        await mq.db["audit_log"].insert_one({
+        await runtime.events.write("audit_log", {
             "request_id": request_id,
             "event": "queued",
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            "created_at": datetime.now(timezone.utc)
         })
         return {
             "Request_Id": request_id,
@@ -41,7 +41,47 @@ def replace_lines(app_logger, lines, replacements):
         print(f"An error occurred during replace_lines: {e}")
         if app_logger:
             try:
-                app_logger.log_error("replace_lines", e)
+                app_logger.log_error_nowait("replace_lines", e)
             except Exception as log_err:
                 print(f"[Logger Failed] {log_err}")
         return lines  # fail-safe fallback
+
+def replaced_ranges(replacements):
+    """
+    Locate replaced line ranges in the file produced by replace_lines.
+
+    Args:
+        replacements (dict): Dict of {(start, end): [new lines]}, 1-based inclusive.
+
+    Returns:
+        list: Sorted (start, end) ranges of the new lines in the modified file.
+    """
+    ranges = []
+    offset = 0
+    for (start, end), replacement_lines in sorted(
+        ((int(s), int(e)), lines) for (s, e), lines in replacements.items()
+    ):
+        new_start = start + offset
+        new_end = new_start + len(replacement_lines) - 1
+        ranges.append((new_start, max(new_end, new_start)))
+        offset += len(replacement_lines) - (end - start + 1)
+    return ranges
+
+def merge_ranges(ranges, context, line_count, first_line=1):
+    """
+    Widen ranges by `context` lines, clip them to [first_line, line_count] and merge overlaps.
+
+    Returns:
+        list: Sorted, non-overlapping (start, end) ranges, 1-based inclusive.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        start = max(start - context, first_line)
+        end = min(end + context, line_count)
+        if start > end:
+            continue
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
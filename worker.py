@@ -0,0 +1,138 @@
+# worker.py
+"""
+Standalone queue worker, run separately from the API:
+
+    python -m worker                  # one process, MAX_THREADS queue workers
+    python -m worker --processes 4    # four worker processes on this host
+
+Workers claim jobs from the shared status_queue, so any number of processes,
+on one host or several, can run against the same queue.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import signal
+import sys
+import time
+from config import Config
+
+
+async def serve(process_index: int = 0):
+    # Built here, inside the worker process, so no client is shared across processes
+    from app_runtime import AppRuntime
+
+    config = Config()
+    runtime = AppRuntime(config)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    await runtime.open()
+    print(f"[WORKER {process_index}] Started.")
+    runtime.queue_worker.start()
+    try:
+        await stop.wait()
+        print(f"[WORKER {process_index}] Stopping: draining running jobs.")
+    finally:
+        await runtime.queue_worker.stop()
+        await runtime.close()
+    print(f"[WORKER {process_index}] Stopped.")
+
+
+def run_process(process_index: int):
+    asyncio.run(serve(process_index))
+
+
+def run_pool(processes: int):
+    """
+    Run worker processes, restarting any that exit unexpectedly, until SIGINT/SIGTERM.
+
+    Returns the exit code: 1 when a process kept failing right after its start.
+    """
+    config = Config()
+    if config.MODEL_RATE_LIMITER != "mongodb":
+        print(
+            "[WORKER] MODEL_RATE_LIMITER is local: each process enforces the model limits on its own. "
+            "Use 'mongodb' to share them."
+        )
+
+    # spawn: every child imports the engine and opens its own connections
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    children = {}
+    started = {}  # index -> monotonic start time of its current process
+    restart_at = {}  # index -> monotonic time its next process may start
+    delays = {}  # index -> delay before its next restart
+    failures = {}  # index -> consecutive exits soon after start
+    exit_code = 0
+    while not stopping:
+        now = time.monotonic()
+        for index in range(processes):
+            child = children.get(index)
+            if child is not None and child.is_alive():
+                continue
+            if child is not None and index not in restart_at:
+                if now - started[index] >= config.WORKER_RESTART_STABLE_SECONDS:
+                    # It ran for a while: start over with the shortest delay
+                    failures[index] = 0
+                    delays[index] = 1
+                else:
+                    failures[index] = failures.get(index, 0) + 1
+                if failures[index] >= config.WORKER_RESTART_MAX_FAILURES:
+                    print(
+                        f"[WORKER] Process {index} exited with code {child.exitcode} "
+                        f"{failures[index]} times in a row; giving up."
+                    )
+                    stopping = True
+                    exit_code = 1
+                    break
+                delay = delays.get(index, 1)
+                delays[index] = min(delay * 2, config.WORKER_RESTART_MAX_DELAY)
+                restart_at[index] = now + delay
+                print(f"[WORKER] Process {index} exited with code {child.exitcode}; restarting in {delay}s.")
+            if now >= restart_at.get(index, 0):
+                restart_at.pop(index, None)
+                child = context.Process(target=run_process, args=(index,), name=f"worker-{index}")
+                child.start()
+                children[index] = child
+                started[index] = now
+        time.sleep(1)
+
+    # Forward the stop to the children and wait for them to drain
+    for child in children.values():
+        if child.is_alive():
+            child.terminate()
+    for child in children.values():
+        child.join(config.WORKER_DRAIN_TIMEOUT_SECONDS + 10)
+        if child.is_alive():
+            child.kill()
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAST Code Fix AI Engine queue worker")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=Config.WORKER_PROCESSES,
+        help="worker processes to run (default: WORKER_PROCESSES)",
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process(0)
+    else:
+        sys.exit(run_pool(args.processes))
+
+
+if __name__ == "__main__":
+    main()